@@ -7,7 +7,10 @@
 # --- END COPYRIGHT BLOCK ---
 #
 import pytest
+import shutil
+import signal
 import subprocess
+import tempfile
 from lib389.utils import *
 from lib389.topologies import topology_st as topo
 
@@ -20,6 +23,33 @@ log = logging.getLogger(__name__)
 
 SYS_TEST_USER = 'dirsrv_testuser'
 
+# checks that the lines come in order - it sleeps on the first line, so the
+# lines read meanwhile are queued
+ORDER_PLUGIN = """import time
+count = 0
+unordered = 0
+def plugin(line):
+    global count, unordered
+    if count == 0:
+        time.sleep(3)
+    if not line.startswith('seq=%d ' % count):
+        unordered += 1
+    count += 1
+    return True
+def post():
+    print("order plugin: %d lines, %d out of order" % (count, unordered))
+"""
+
+# raises an exception on the 100th line
+RAISE_PLUGIN = """count = 0
+def plugin(line):
+    global count
+    count += 1
+    if count == 100:
+        raise ValueError("bad line %d" % count)
+    return True
+"""
+
 
 @pytest.fixture(scope="module")
 def sys_test_user(request):
@@ -45,6 +75,50 @@ def sys_test_user(request):
     request.addfinalizer(fin)
 
 
+@pytest.fixture
+def tmp_dir(request):
+    """Creates and deletes a directory for the log pipes"""
+
+    path = tempfile.mkdtemp(prefix='logpipe_test-')
+
+    def fin():
+        shutil.rmtree(path)
+
+    request.addfinalizer(fin)
+    return path
+
+
+def _start_logpipe(topo, pipes, args):
+    """Starts ds-logpipe on the log pipes, it watches a fake server process"""
+
+    ds_logpipe_path = os.path.join(topo.standalone.ds_paths.bin_dir, 'ds-logpipe.py')
+    server = subprocess.Popen(['sleep', '600'])
+    logpipe = subprocess.Popen([ds_logpipe_path] + pipes + ['--serverpid', str(server.pid)] + args,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT, encoding='utf-8')
+    while not all([os.path.exists(pipe) for pipe in pipes]):
+        time.sleep(0.1)
+    return server, logpipe
+
+
+def _stop_logpipe(server, logpipe):
+    """Stops the fake server and returns the output of ds-logpipe"""
+
+    time.sleep(1)
+    server.kill()
+    server.wait()
+    output = logpipe.communicate(timeout=60)[0]
+    log.debug(output)
+    assert logpipe.returncode == 0
+    return output
+
+
+def _write_pipe(pipe, lines):
+    """Writes the lines to a log pipe, like the server does"""
+
+    with open(pipe, 'w', encoding='utf-8') as pipe_file:
+        pipe_file.writelines(lines)
+
+
 def test_user_permissions(topo, sys_test_user):
     """Check permissions for usual user operations in log dir
 
@@ -69,6 +143,261 @@ def test_user_permissions(topo, sys_test_user):
         assert 'Permission denied' in result
 
 
+def test_ring_buffer(topo, tmp_dir):
+    """Check that the default plugin keeps the last lines read in small chunks
+
+    :ID: 638d9c52-89f3-49e0-b056-5a830fb4e5f4
+    :feature: ds-logpipe
+    :setup: Standalone instance
+    :steps: 1. Start ds-logpipe with a buffer of 5 lines, reading 7 bytes at a time
+            2. Write 1000 lines to the pipe, and a last line without a newline
+            3. Stop the server
+    :expectedresults: Only the last lines are printed, with the multibyte
+                      characters split between the reads decoded
+    """
+
+    pipe = os.path.join(tmp_dir, 'access.pipe')
+    server, logpipe = _start_logpipe(topo, [pipe], ['-m', '5', '-b', '7'])
+    _write_pipe(pipe, ['conn={} op=0 line \u00e9\u00e8\n'.format(idx) for idx in range(1000)] +
+                ['last line without a newline'])
+    output = _stop_logpipe(server, logpipe)
+
+    assert 'conn=995 ' not in output
+    assert 'conn=996 op=0 line \u00e9\u00e8\nconn=997 op=0 line \u00e9\u00e8\n' in output
+    assert 'conn=999 op=0 line \u00e9\u00e8\nlast line without a newline' in output
+    assert 'Read 1001 total lines' in output
+
+
+def test_plugin_threads(topo, tmp_dir):
+    """Check that a slow plugin thread holds up the reading once its queue is full
+
+    :ID: f834a00d-7ec2-4565-8c22-44456b64ff26
+    :feature: ds-logpipe
+    :setup: Standalone instance
+    :steps: 1. Start ds-logpipe with a thread for the plugin, and a queue of
+               2 batches: the plugin sleeps on the first line
+            2. Write 2000 lines to the pipe
+            3. Stop the server
+    :expectedresults: The plugin gets all the lines in order, and the
+                      statistics of its thread are printed, its queue never
+                      holds more than 2 batches
+    """
+
+    pipe = os.path.join(tmp_dir, 'access.pipe')
+    plugin = os.path.join(tmp_dir, 'orderplugin.py')
+    with open(plugin, 'w') as plugin_file:
+        plugin_file.write(ORDER_PLUGIN)
+
+    server, logpipe = _start_logpipe(topo, [pipe], ['--threaded', '-q', '2', '-b', '512', '--plugin', plugin])
+    _write_pipe(pipe, ['seq={} {}\n'.format(idx, 'x' * 60) for idx in range(2000)])
+    output = _stop_logpipe(server, logpipe)
+
+    assert 'order plugin: 2000 lines, 0 out of order' in output
+    stats = [line for line in output.splitlines() if line.startswith('orderplugin.plugin: ')]
+    assert len(stats) == 1
+    assert stats[0].startswith('orderplugin.plugin: 2000 lines in ')
+    assert 'queue depth 0 (max 2)' in stats[0]
+
+
+def test_plugin_thread_error(topo, tmp_dir):
+    """Check that a plugin thread that raises an exception does not stop the reading
+
+    :ID: f3637689-3c16-49ec-9095-7b12e1bbc806
+    :feature: ds-logpipe
+    :setup: Standalone instance
+    :steps: 1. Start ds-logpipe with a thread for each plugin, and a queue
+               of 2 batches: one plugin raises an exception on the 100th
+               line, the other one sleeps on the first line
+            2. Write 2000 lines to the pipe
+            3. Stop the server
+    :expectedresults: The error of the first plugin is printed, the other
+                      plugin still gets all the lines in order, and the
+                      statistics of both threads are printed
+    """
+
+    pipe = os.path.join(tmp_dir, 'access.pipe')
+    raise_plugin = os.path.join(tmp_dir, 'raiseplugin.py')
+    with open(raise_plugin, 'w') as plugin_file:
+        plugin_file.write(RAISE_PLUGIN)
+    order_plugin = os.path.join(tmp_dir, 'orderplugin.py')
+    with open(order_plugin, 'w') as plugin_file:
+        plugin_file.write(ORDER_PLUGIN)
+
+    server, logpipe = _start_logpipe(topo, [pipe], ['--threaded', '-q', '2', '-b', '512',
+                                                    '--plugin', raise_plugin, '--plugin', order_plugin])
+    _write_pipe(pipe, ['seq={} {}\n'.format(idx, 'x' * 60) for idx in range(2000)])
+    output = _stop_logpipe(server, logpipe)
+
+    assert 'Error: plugin raiseplugin.plugin failed: bad line 100' in output
+    assert 'Aborting' not in output
+    assert 'order plugin: 2000 lines, 0 out of order' in output
+    stats = [line for line in output.splitlines() if line.startswith('orderplugin.plugin: ')]
+    assert len(stats) == 1
+    assert stats[0].startswith('orderplugin.plugin: 2000 lines in ')
+    stats = [line for line in output.splitlines() if line.startswith('raiseplugin.plugin: ')]
+    assert len(stats) == 1
+    assert stats[0].endswith(', failed')
+
+
+def test_spill_queue(topo, tmp_dir):
+    """Check that the lines spilled to disk are read back in order
+
+    :ID: 9e9f58c8-8b7a-4fa9-b189-c0f4b7ab536f
+    :feature: ds-logpipe
+    :setup: Standalone instance
+    :steps: 1. Start ds-logpipe with a slow plugin, a queue of one batch, and
+               a spill directory with segments of 1 megabyte
+            2. Write 40000 lines to the pipe while the plugin is busy
+            3. Stop the server
+    :expectedresults: The lines are spilled to several segments, the plugin
+                      gets all of them in order, and the segments are removed
+    """
+
+    pipe = os.path.join(tmp_dir, 'access.pipe')
+    plugin = os.path.join(tmp_dir, 'orderplugin.py')
+    spilldir = os.path.join(tmp_dir, 'spill')
+    os.mkdir(spilldir)
+    with open(plugin, 'w') as plugin_file:
+        plugin_file.write(ORDER_PLUGIN)
+
+    server, logpipe = _start_logpipe(topo, [pipe], ['--plugin', plugin, '-q', '1', '-b', '4096',
+                                                    '--spilldir', spilldir, '--spillsegsize', '1'])
+    _write_pipe(pipe, ['seq={} {}\n'.format(idx, 'x' * 60) for idx in range(40000)])
+    output = _stop_logpipe(server, logpipe)
+
+    assert 'order plugin: 40000 lines, 0 out of order' in output
+    assert 'spilled ' in output
+    assert 'spilled 0 lines' not in output
+    assert os.listdir(spilldir) == []
+
+
+def test_multi_pipe(topo, tmp_dir):
+    """Check that a plugin given for one of the pipes only gets its lines
+
+    :ID: fc2aac91-9ba8-43fe-a85c-da5dcc9107c3
+    :feature: ds-logpipe
+    :setup: Standalone instance
+    :steps: 1. Start ds-logpipe on two pipes, with a plugin for the first one
+            2. Write lines to both pipes
+            3. Send SIGHUP to ds-logpipe
+            4. Stop the server
+    :expectedresults: The plugin only gets the lines of the first pipe, and
+                      the buffer of the second pipe is printed on SIGHUP
+                      and at exit
+    """
+
+    pipe_a = os.path.join(tmp_dir, 'access.pipe')
+    pipe_b = os.path.join(tmp_dir, 'errors.pipe')
+    plugin = os.path.join(tmp_dir, 'orderplugin.py')
+    with open(plugin, 'w') as plugin_file:
+        plugin_file.write(ORDER_PLUGIN)
+
+    server, logpipe = _start_logpipe(topo, [pipe_a, pipe_b], ['--plugin', '{}:{}'.format(pipe_a, plugin),
+                                                              '-m', '3'])
+    _write_pipe(pipe_a, ['seq={} pipe a\n'.format(idx) for idx in range(300)])
+    _write_pipe(pipe_b, ['conn={} op=0 pipe b\n'.format(idx) for idx in range(500)])
+    # the pipes are read once the plugin is done sleeping on its first line
+    time.sleep(4)
+    logpipe.send_signal(signal.SIGHUP)
+    output = _stop_logpipe(server, logpipe)
+
+    assert 'order plugin: 300 lines, 0 out of order' in output
+    assert 'seq=299 pipe a' not in output
+    assert 'conn=496 ' not in output
+    assert output.count('conn=497 op=0 pipe b\nconn=498 op=0 pipe b\nconn=499 op=0 pipe b\n') == 2
+    assert output.count('Read 500 total lines') == 2
+
+
+def test_multi_pipe_same_plugin(topo, tmp_dir):
+    """Check that a plugin given for two of the pipes runs once for each of them
+
+    :ID: 4b86c13d-25f0-44cd-aa1f-3497892c3b80
+    :feature: ds-logpipe
+    :setup: Standalone instance
+    :steps: 1. Start ds-logpipe on two pipes, with the same plugin given for each of them
+            2. Write lines to both pipes
+            3. Stop the server
+    :expectedresults: Each copy of the plugin only gets the lines of its pipe, in order
+    """
+
+    pipe_a = os.path.join(tmp_dir, 'access.pipe')
+    pipe_b = os.path.join(tmp_dir, 'errors.pipe')
+    plugin = os.path.join(tmp_dir, 'orderplugin.py')
+    with open(plugin, 'w') as plugin_file:
+        plugin_file.write(ORDER_PLUGIN)
+
+    server, logpipe = _start_logpipe(topo, [pipe_a, pipe_b], ['--plugin', '{}:{}'.format(pipe_a, plugin),
+                                                              '--plugin', '{}:{}'.format(pipe_b, plugin)])
+    _write_pipe(pipe_a, ['seq={} pipe a\n'.format(idx) for idx in range(300)])
+    _write_pipe(pipe_b, ['seq={} pipe b\n'.format(idx) for idx in range(500)])
+    output = _stop_logpipe(server, logpipe)
+
+    assert 'order plugin: 300 lines, 0 out of order' in output
+    assert 'order plugin: 500 lines, 0 out of order' in output
+    assert output.count('order plugin: ') == 2
+    assert 'Read ' not in output
+
+
+def test_failedbinds(topo, tmp_dir):
+    """Check that the failedbinds plugin evicts the old connections and flushes its log
+
+    :ID: 49fa0f3d-5cd7-418f-8b63-8c8acfbb7d3d
+    :feature: ds-logpipe
+    :setup: Standalone instance
+    :steps: 1. Start ds-logpipe with the failedbinds plugin, keeping at most 2
+               connections for 2 seconds, and flushing its log every 0.5 seconds
+            2. Open 3 connections, and fail a bind on the first and the last one
+            3. Wait, and check the log of the plugin
+            4. Wait for the connections to time out, open a connection, and
+               fail a bind on the last connection of step 2 and on the new one
+            5. Stop the server
+    :expectedresults: The failed binds are in the log before ds-logpipe exits.
+                      The address of a connection is unknown once it is
+                      evicted, because there are too many or it is too old
+    """
+
+    pipe = os.path.join(tmp_dir, 'access.pipe')
+    logfile = os.path.join(tmp_dir, 'binds.log')
+    plugin = os.path.join(topo.standalone.ds_paths.lib_dir, 'dirsrv', 'python', 'failedbinds.py')
+    timestamp = '[18/Oct/2026:10:00:00.000000000 +0000]'
+
+    def conn_lines(connid):
+        return ['{} conn={} fd={} slot={} connection from 10.0.0.{} to 10.0.0.254\n'.format(
+                timestamp, connid, connid + 64, connid + 64, connid)]
+
+    def failed_bind_lines(connid, opid):
+        return ['{} conn={} op={} BIND dn="uid=user{}" method=128 version=3\n'.format(timestamp, connid, opid, connid),
+                '{} conn={} op={} RESULT err=49 tag=97 nentries=0 etime=0\n'.format(timestamp, connid, opid)]
+
+    server, logpipe = _start_logpipe(topo, [pipe], ['--plugin', plugin, 'failedbinds.logfile=' + logfile,
+                                                    'failedbinds.maxconns=2', 'failedbinds.conntimeout=2',
+                                                    'failedbinds.flushinterval=0.5'])
+    # ds-logpipe stops reading once the pipe is closed, keep it open
+    with open(pipe, 'w', encoding='utf-8') as pipe_file:
+        pipe_file.writelines(conn_lines(1) + conn_lines(2) + conn_lines(3) +
+                             failed_bind_lines(1, 0) + failed_bind_lines(3, 0))
+        pipe_file.flush()
+        time.sleep(1.5)
+        with open(logfile, 'r') as log_file:
+            failed_binds = log_file.readlines()
+        assert len(failed_binds) == 2
+        assert ' conn=1 op=0 err=49 ' in failed_binds[0]
+        assert failed_binds[0].rstrip().endswith('ip=unknown extra=')
+        assert ' conn=3 op=0 err=49 ' in failed_binds[1]
+        assert failed_binds[1].rstrip().endswith('ip=10.0.0.3 extra=')
+
+        time.sleep(1.5)
+        pipe_file.writelines(conn_lines(4) + failed_bind_lines(3, 1) + failed_bind_lines(4, 0))
+    _stop_logpipe(server, logpipe)
+    with open(logfile, 'r') as log_file:
+        failed_binds = log_file.readlines()
+    assert len(failed_binds) == 4
+    assert ' conn=3 op=1 err=49 ' in failed_binds[2]
+    assert failed_binds[2].rstrip().endswith('ip=unknown extra=')
+    assert ' conn=4 op=0 err=49 ' in failed_binds[3]
+    assert failed_binds[3].rstrip().endswith('ip=10.0.0.4 extra=')
+
+
 if __name__ == '__main__':
     # Run isolated
     # -s for DEBUG mode
@@ -6,6 +6,10 @@
 # See LICENSE for details.
 # --- END COPYRIGHT BLOCK ---
 #
+import glob
+import gzip
+import lzma
+import shutil
 import pytest
 import subprocess
 from lib389.utils import *
@@ -139,9 +143,39 @@ def replcheck_cmd_list(topo_tls_ldapi):
                       '-r', 'ldapi://%2fvar%2frun%2fslapd-{}.socket'.format(m2.serverid)],
                      [ds_replcheck_path, '-b', DEFAULT_SUFFIX, '--conflict',
                       '-M', '/tmp/export_{}.ldif'.format(m1.serverid),
-                      '-R', '/tmp/export_{}.ldif'.format(m2.serverid)]]
+                      '-R', '/tmp/export_{}.ldif'.format(m2.serverid)],
+                     [ds_replcheck_path, '-b', DEFAULT_SUFFIX, '--conflict', '-s', '--sortsize', '10',
+                      '-M', '/tmp/export_{}.ldif'.format(m1.serverid),
+                      '-R', '/tmp/export_{}.ldif'.format(m2.serverid)],
+                     [ds_replcheck_path, '-b', DEFAULT_SUFFIX, '--conflict', '-j', '2',
+                      '-M', '/tmp/export_{}.ldif'.format(m1.serverid),
+                      '-R', '/tmp/export_{}.ldif'.format(m2.serverid)],
+                     [ds_replcheck_path, '-b', DEFAULT_SUFFIX, '-D', DN_DM, '-w', PW_DM, '-l', '1',
+                      '-m', 'ldap://{}:{}'.format(m1.host, m1.port), '--conflict', '--json', '/tmp/replcheck.json',
+                      '-r', 'ldap://{}:{}'.format(m2.host, m2.port)]]
     return replcheck_cmd
 
+def _parse_report(result):
+    """Returns the DNs of the entries missing on the replica, of the entries
+    missing on the master, and of the different entries found in a report
+    """
+
+    report = {'replica': set(), 'master': set(), 'diff': set()}
+    section = None
+    lines = result.lower().splitlines()
+    for idx, line in enumerate(lines):
+        if line.strip() == 'entries missing on replica:':
+            section = 'replica'
+        elif line.strip() == 'entries missing on master:':
+            section = 'master'
+        elif line.strip() == 'entry inconsistencies':
+            section = 'diff'
+        elif section in ('replica', 'master') and line.strip().startswith('- '):
+            report[section].add(line.strip()[2:].split('  (created on')[0])
+        elif section == 'diff' and line and idx + 1 < len(lines) and lines[idx + 1] == '-' * len(line):
+            report['diff'].add(line)
+    return report
+
 
 def test_check_ruv(topo_tls_ldapi):
     """Check that the report has RUV
@@ -348,6 +382,389 @@ def test_inconsistencies(topo_tls_ldapi):
         user_m1.delete()
 
 
+def test_incremental(topo_tls_ldapi):
+    """Check that the incremental mode reports the entries changed since the snapshot
+
+    :id: d5bccf4a-55e7-4c27-871b-efca00d9ce05
+    :setup: Two master replication
+    :steps:
+        1. Add an entry to master and wait for replication
+        2. Generate the report and save the snapshot
+        3. Pause replication between master and replica
+        4. Add an entry to master and change the entry on replica
+        5. Generate the incremental report
+        6. Check the missing and different entries of the report
+        7. Rename the changed entry on master
+        8. Generate the incremental report
+        9. Check the missing and different entries of the report
+    :expectedresults:
+        1. It should be successful
+        2. It should be successful
+        3. It should be successful
+        4. It should be successful
+        5. It should be successful
+        6. The new entry should be missing on replica, and the changed entry
+           should be different
+        7. It should be successful
+        8. It should be successful
+        9. The entry should be missing on replica under its new DN, and on
+           master under its old DN
+    """
+
+    m1 = topo_tls_ldapi.ms["master1"]
+    m2 = topo_tls_ldapi.ms["master2"]
+    snapshot = '/tmp/replcheck_snapshot'
+    attr_m2 = "m2_incremental"
+    user0 = None
+    user1 = None
+
+    ds_replcheck_path = os.path.join(m1.ds_paths.bin_dir, 'ds-replcheck')
+    tool_cmd = [ds_replcheck_path, '-b', DEFAULT_SUFFIX, '-D', DN_DM, '-w', PW_DM, '-l', '1',
+                '-m', 'ldap://{}:{}'.format(m1.host, m1.port),
+                '-r', 'ldap://{}:{}'.format(m2.host, m2.port), '--snapshot', snapshot]
+    try:
+        users_m1 = UserAccounts(m1, DEFAULT_SUFFIX)
+        user0 = users_m1.create_test_user(1005)
+        time.sleep(1)
+        subprocess.check_output(tool_cmd, encoding='utf-8')
+
+        topo_tls_ldapi.pause_all_replicas()
+        user1 = users_m1.create_test_user(1006)
+        UserAccounts(m2, DEFAULT_SUFFIX).get(user0.rdn).set("description", attr_m2)
+        time.sleep(2)
+
+        result = subprocess.check_output(tool_cmd + ['--incremental'], encoding='utf-8')
+        assert 'Performing incremental online report' in result
+        report = _parse_report(result)
+        assert report['replica'] == set([user1.dn.lower()])
+        assert report['master'] == set()
+        assert user0.dn.lower() in report['diff']
+        assert attr_m2 in result
+
+        old_dn = user0.dn
+        user0.rename('uid=test_user_1009')
+        result = subprocess.check_output(tool_cmd + ['--incremental'], encoding='utf-8')
+        report = _parse_report(result)
+        assert report['replica'] == set([user0.dn.lower(), user1.dn.lower()])
+        assert report['master'] == set([old_dn.lower()])
+        assert old_dn.lower() not in report['diff']
+    finally:
+        topo_tls_ldapi.resume_all_replicas()
+        if user0 is not None:
+            user0.delete()
+        if user1 is not None:
+            user1.delete()
+        for snapshot_file in glob.glob(snapshot + '*'):
+            os.remove(snapshot_file)
+
+
+@pytest.mark.parametrize("mode_args", [('-p', '2'),
+                                       ('-p', '3', '--prefetch', '1'),
+                                       ('-S', '-p', '2'),
+                                       ('--recheck',)])
+def test_online_modes(topo_tls_ldapi, mode_args):
+    """Check that the online report finds the seeded differences in every mode
+
+    :id: 893dc790-aea9-44d0-9e46-25e16dcafc8a
+    :setup: Two master replication
+    :steps:
+        1. Add an entry to master and wait for replication
+        2. Pause replication between master and replica
+        3. Add an entry to master and to replica, and change the first entry on replica
+        4. Generate the report with the options of the mode
+        5. Check the missing and different entries of the report
+    :expectedresults:
+        1. It should be successful
+        2. It should be successful
+        3. It should be successful
+        4. It should be successful
+        5. The new entries should be missing on the other server, and the
+           changed entry should be different
+    """
+
+    m1 = topo_tls_ldapi.ms["master1"]
+    m2 = topo_tls_ldapi.ms["master2"]
+    attr_m2 = "m2_online_mode"
+    user0 = None
+    user1 = None
+    user2 = None
+
+    ds_replcheck_path = os.path.join(m1.ds_paths.bin_dir, 'ds-replcheck')
+    tool_cmd = [ds_replcheck_path, '-b', DEFAULT_SUFFIX, '-D', DN_DM, '-w', PW_DM, '-l', '1',
+                '-m', 'ldap://{}:{}'.format(m1.host, m1.port),
+                '-r', 'ldap://{}:{}'.format(m2.host, m2.port)] + list(mode_args)
+    try:
+        users_m1 = UserAccounts(m1, DEFAULT_SUFFIX)
+        users_m2 = UserAccounts(m2, DEFAULT_SUFFIX)
+        user0 = users_m1.create_test_user(1010)
+        time.sleep(1)
+        topo_tls_ldapi.pause_all_replicas()
+        user1 = users_m1.create_test_user(1011)
+        user2 = users_m2.create_test_user(1012)
+        users_m2.get(user0.rdn).set("description", attr_m2)
+        time.sleep(2)
+
+        result = subprocess.check_output(tool_cmd, encoding='utf-8')
+        report = _parse_report(result)
+        assert user1.dn.lower() in report['replica']
+        assert user2.dn.lower() in report['master']
+        assert user0.dn.lower() in report['diff']
+        assert user1.dn.lower() not in report['master'] | report['diff']
+        assert user2.dn.lower() not in report['replica'] | report['diff']
+        assert user0.dn.lower() not in report['replica'] | report['master']
+        assert attr_m2 in result
+    finally:
+        topo_tls_ldapi.resume_all_replicas()
+        for user in (user0, user1, user2):
+            if user is not None:
+                user.delete()
+
+
+def test_topology(topo_tls_ldapi):
+    """Check that the topology mode reports the entries that differ on any replica
+
+    :id: 8d761033-0336-46bc-a592-b5e7f5638c2d
+    :setup: Two master replication
+    :steps:
+        1. Add an entry to master and wait for replication
+        2. Pause replication between master and replica
+        3. Add an entry to master and change the first entry on replica
+        4. Generate the topology report, the replica is given twice (ldap and ldaps)
+        5. Check that both entries are mentioned in the report
+        6. Generate the topology report with a lag time of one hour
+        7. Check that the changed entry is not mentioned in the report
+    :expectedresults:
+        1. It should be successful
+        2. It should be successful
+        3. It should be successful
+        4. It should be successful
+        5. The entries DN should be mentioned in the report
+        6. It should be successful
+        7. The recent change should be ignored
+    """
+
+    m1 = topo_tls_ldapi.ms["master1"]
+    m2 = topo_tls_ldapi.ms["master2"]
+    user0 = None
+    user1 = None
+
+    ds_replcheck_path = os.path.join(m1.ds_paths.bin_dir, 'ds-replcheck')
+    tool_cmd = [ds_replcheck_path, '-b', DEFAULT_SUFFIX, '-D', DN_DM, '-w', PW_DM,
+                '-m', 'ldap://{}:{}'.format(m1.host, m1.port),
+                '-r', 'ldap://{}:{}'.format(m2.host, m2.port),
+                '-r', 'ldaps://{}:{}'.format(m2.host, m2.sslport)]
+    try:
+        users_m1 = UserAccounts(m1, DEFAULT_SUFFIX)
+        user0 = users_m1.create_test_user(1007)
+        time.sleep(1)
+        topo_tls_ldapi.pause_all_replicas()
+        user1 = users_m1.create_test_user(1008)
+        UserAccounts(m2, DEFAULT_SUFFIX).get(user0.rdn).set("description", "m2_topology")
+        time.sleep(2)
+
+        result = subprocess.check_output(tool_cmd + ['-l', '1'], encoding='utf-8')
+        assert 'Replication Topology Report' in result
+        assert user1.dn.lower() in result.lower()
+        assert user0.dn.lower() in result.lower()
+        assert 'different attributes: description' in result
+
+        result = subprocess.check_output(tool_cmd + ['-l', '3600'], encoding='utf-8')
+        assert user1.dn.lower() in result.lower()
+        assert user0.dn.lower() not in result.lower()
+    finally:
+        topo_tls_ldapi.resume_all_replicas()
+        if user0 is not None:
+            user0.delete()
+        if user1 is not None:
+            user1.delete()
+
+
+def test_sample_quick_check(topo_tls_ldapi):
+    """Check that the quick check stops when the RUVs are different
+
+    :id: 6738c4b7-736c-47de-827f-c814dcfaa4d5
+    :setup: Two master replication
+    :steps:
+        1. Pause replication between master and replica
+        2. Add an entry to master
+        3. Generate the quick check report
+        4. Check that the report says the replicas are not in sync
+    :expectedresults:
+        1. It should be successful
+        2. It should be successful
+        3. It should be successful
+        4. The report should say the replicas are not in sync
+    """
+
+    m1 = topo_tls_ldapi.ms["master1"]
+    m2 = topo_tls_ldapi.ms["master2"]
+    user0 = None
+
+    try:
+        topo_tls_ldapi.pause_all_replicas()
+        users_m1 = UserAccounts(m1, DEFAULT_SUFFIX)
+        user0 = users_m1.create_test_user(1004)
+
+        ds_replcheck_path = os.path.join(m1.ds_paths.bin_dir, 'ds-replcheck')
+        tool_cmd = [ds_replcheck_path, '-b', DEFAULT_SUFFIX, '-D', DN_DM, '-w', PW_DM, '--sample', '10',
+                    '-m', 'ldap://{}:{}'.format(m1.host, m1.port),
+                    '-r', 'ldap://{}:{}'.format(m2.host, m2.port)]
+        result = subprocess.check_output(tool_cmd, encoding='utf-8')
+        assert 'Replication Quick Check Report' in result
+        assert 'the replicas are not in sync' in result
+    finally:
+        if user0 is not None:
+            user0.delete()
+        topo_tls_ldapi.resume_all_replicas()
+
+
+def test_compressed_ldif(topo_tls_ldapi):
+    """Check that the offline report reads gzip and xz compressed LDIF files
+
+    :id: 70ee1e10-da1d-4d3c-a447-e10fae8e32b1
+    :setup: Two master replication
+    :steps:
+        1. Add an entry to master and wait for replication
+        2. Pause replication between master and replica
+        3. Add an entry to master and to replica, and change the first entry on replica
+        4. Export the masters, and compress the LDIF files with gzip and xz
+        5. Generate the offline reports of the compressed LDIF files
+        6. Check the missing and different entries of the reports
+    :expectedresults:
+        1. It should be successful
+        2. It should be successful
+        3. It should be successful
+        4. It should be successful
+        5. It should be successful
+        6. The new entries should be missing on the other server, and the
+           changed entry should be different
+    """
+
+    m1 = topo_tls_ldapi.ms["master1"]
+    m2 = topo_tls_ldapi.ms["master2"]
+    attr_m2 = "m2_compressed"
+    user0 = None
+    user1 = None
+    user2 = None
+    compressed_files = []
+
+    ds_replcheck_path = os.path.join(m1.ds_paths.bin_dir, 'ds-replcheck')
+    try:
+        users_m1 = UserAccounts(m1, DEFAULT_SUFFIX)
+        users_m2 = UserAccounts(m2, DEFAULT_SUFFIX)
+        user0 = users_m1.create_test_user(1013)
+        time.sleep(1)
+        topo_tls_ldapi.pause_all_replicas()
+        user1 = users_m1.create_test_user(1014)
+        user2 = users_m2.create_test_user(1015)
+        users_m2.get(user0.rdn).set("description", attr_m2)
+        time.sleep(2)
+
+        # Only export the masters
+        replcheck_cmd_list(topo_tls_ldapi)
+        for inst in topo_tls_ldapi:
+            export = '/tmp/export_{}.ldif'.format(inst.serverid)
+            for suffix, compressed_open in (('.gz', gzip.open), ('.xz', lzma.open)):
+                with open(export, 'rb') as ldif, compressed_open(export + suffix, 'wb') as compressed:
+                    shutil.copyfileobj(ldif, compressed)
+                compressed_files.append(export + suffix)
+
+        # Both gzip files use the indexed comparison, an xz file the sort/merge comparison
+        for msuffix, rsuffix in (('.gz', '.gz'), ('.xz', '.gz'), ('.gz', '.xz')):
+            tool_cmd = [ds_replcheck_path, '-b', DEFAULT_SUFFIX, '-l', '1',
+                        '-M', '/tmp/export_{}.ldif{}'.format(m1.serverid, msuffix),
+                        '-R', '/tmp/export_{}.ldif{}'.format(m2.serverid, rsuffix)]
+            result = subprocess.check_output(tool_cmd, encoding='utf-8')
+            report = _parse_report(result)
+            assert user1.dn.lower() in report['replica']
+            assert user2.dn.lower() in report['master']
+            assert user0.dn.lower() in report['diff']
+            assert user1.dn.lower() not in report['master'] | report['diff']
+            assert user2.dn.lower() not in report['replica'] | report['diff']
+            assert attr_m2 in result
+    finally:
+        topo_tls_ldapi.resume_all_replicas()
+        for user in (user0, user1, user2):
+            if user is not None:
+                user.delete()
+        for compressed_file in compressed_files:
+            os.remove(compressed_file)
+
+
+def test_checkpoint_resume(topo_tls_ldapi):
+    """Check that an interrupted offline comparison is resumed from its checkpoint
+
+    :id: 1ac324bd-183a-497f-b5f5-ae8b0e94a539
+    :setup: Two master replication
+    :steps:
+        1. Export the masters, and add many entries to both LDIF files, one of
+           them is missing and one of them is different in the replica LDIF file
+        2. Generate the report with a checkpoint file, and kill the tool once
+           the checkpoint is saved
+        3. Generate the report again with the same checkpoint file
+        4. Check the missing and different entries of the report, and that the
+           checkpoint is removed
+    :expectedresults:
+        1. It should be successful
+        2. It should be successful
+        3. The comparison should resume from the checkpoint
+        4. Both entries should be reported once
+    """
+
+    m1 = topo_tls_ldapi.ms["master1"]
+    m2 = topo_tls_ldapi.ms["master2"]
+    mldif = '/tmp/checkpoint_{}.ldif'.format(m1.serverid)
+    rldif = '/tmp/checkpoint_{}.ldif'.format(m2.serverid)
+    checkpoint = '/tmp/replcheck_checkpoint.json'
+    num_users = 50000
+    missing_dn = 'uid=checkpoint_user{},ou=People,{}'.format(num_users // 2, DEFAULT_SUFFIX)
+    different_dn = 'uid=checkpoint_user{},ou=People,{}'.format(num_users - 1, DEFAULT_SUFFIX)
+    attr_r_only = "checkpoint_inconsistency"
+
+    # Only export the masters
+    replcheck_cmd_list(topo_tls_ldapi)
+    for inst, ldif_file in ((m1, mldif), (m2, rldif)):
+        with open('/tmp/export_{}.ldif'.format(inst.serverid), 'r') as export, open(ldif_file, 'w') as ldif:
+            shutil.copyfileobj(export, ldif)
+            ldif.write('\n')
+            for idx in range(num_users):
+                dn = 'uid=checkpoint_user{},ou=People,{}'.format(idx, DEFAULT_SUFFIX)
+                description = 'checkpoint'
+                if inst is m2:
+                    if dn == missing_dn:
+                        continue
+                    if dn == different_dn:
+                        description = attr_r_only
+                ldif.write('dn: {}\nobjectClass: top\nobjectClass: person\nuid: checkpoint_user{}\n'
+                           'cn: checkpoint_user{}\nsn: {}\ndescription: {}\n\n'.format(dn, idx, idx, idx, description))
+
+    ds_replcheck_path = os.path.join(m1.ds_paths.bin_dir, 'ds-replcheck')
+    tool_cmd = [ds_replcheck_path, '-b', DEFAULT_SUFFIX, '-M', mldif, '-R', rldif, '--checkpoint', checkpoint]
+    try:
+        proc = subprocess.Popen(tool_cmd, stdout=subprocess.DEVNULL)
+        while not os.path.exists(checkpoint) and proc.poll() is None:
+            time.sleep(0.1)
+        interrupted = proc.poll() is None
+        proc.kill()
+        proc.wait()
+        log.info("Comparison interrupted before the end: {}".format(interrupted))
+
+        result = subprocess.check_output(tool_cmd, encoding='utf-8')
+        if interrupted:
+            assert 'Resuming from the checkpoint' in result
+        report = _parse_report(result)
+        assert missing_dn.lower() in report['replica']
+        assert different_dn.lower() in report['diff']
+        assert result.lower().count(missing_dn.lower()) == 1
+        assert result.lower().count(different_dn.lower() + '\n') == 1
+        assert attr_r_only in result
+        assert not os.path.exists(checkpoint)
+    finally:
+        for tmp_file in (mldif, rldif, checkpoint):
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+
 if __name__ == '__main__':
     # Run isolated
     # -s for DEBUG mode
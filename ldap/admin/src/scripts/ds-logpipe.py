@@ -11,36 +11,320 @@ import types
 import time
 import fcntl
 import pwd
+import threading
+import traceback
+from collections import deque
+try:
+    import queue
+except ImportError: # python 2
+    import Queue as queue
+try:
+    import selectors
+except ImportError: # python 2 - only one pipe per process
+    selectors = None
 
 maxlines = 1000 # set on command line
+readsize = 65536 # set on command line
+queuesize = 1000 # set on command line
+spilldir = None # set on command line
+spillsegsize = 64 * 1024 * 1024 # set on command line
+spillmax = 1024 * 1024 * 1024 # set on command line
+stoptimeout = 10 # seconds to wait for each plugin thread at exit
 S_IFIFO = 0o010000
 
-buffer = [] # default circular buffer used by default plugin
+buffer = deque(maxlen=maxlines) # default circular buffer used by default plugin
 totallines = 0
 logfname = "" # name of log pipe
 debug = False
 
-# default plugin just keeps a circular buffer
+# default plugin just keeps a circular buffer - the deque drops
+# the oldest line when it is full
 def defaultplugin(line):
     global totallines
     buffer.append(line)
     totallines = totallines + 1
-    if len(buffer) > maxlines:
-        del buffer[0]
+    return True
+
+def defaultplugin_batch(lines):
+    global totallines
+    buffer.extend(lines)
+    totallines = totallines + len(lines)
     return True
 
 def printbuffer():
-    sys.stdout.writelines(buffer)
+    if pipes and not totallines:
+        return # the pipes have their own buffers
+    # copy the buffer first - a plugin thread may be adding to it
+    sys.stdout.writelines(list(buffer))
     print("Read %d total lines" % totallines)
     print(logfname, "=" * 60)
     sys.stdout.flush()
 
 def defaultpost(): printbuffer()
 
-plgfuncs = [] # list of plugin functions
+plgfuncs = [] # list of plugin batch functions
 plgpostfuncs = [] # list of post plugin funcs
+plgpipes = {} # plugin batch function -> the only pipe it is used with, if any
+plgfiles = set() # plugin files already imported
+workers = [] # plugin threads, when using --threaded
+pipes = [] # pipes watched by the event loop, when using several pipes
+
+def batchplugin(plgfunc):
+    '''wrap a plugin function that processes one line at a time
+    so that it can be called with a batch of lines'''
+    def plugin_batch(lines):
+        for line in lines:
+            if not plgfunc(line):
+                return False
+        return True
+    plugin_batch.__module__ = plgfunc.__module__
+    plugin_batch.__name__ = plgfunc.__name__
+    return plugin_batch
+
+def encode_batch(lines):
+    data = ''.join(lines)
+    if not isinstance(data, bytes): # python 3
+        data = data.encode('utf-8')
+    return data
+
+def decode_batch(data):
+    if sys.version_info >= (3, 0):
+        data = data.decode('utf-8')
+    lines = [line + '\n' for line in data.split('\n')]
+    lines[-1] = lines[-1][:-1] # the last line has no newline, if any
+    if not lines[-1]:
+        lines.pop()
+    return lines
+
+class SpillQueue(object):
+    '''a queue of batches of lines that never blocks the reader - once
+    maxsize batches are waiting in memory, the batches are appended to
+    segment files of about segsize bytes in the spill directory, and they
+    are read back in order once the plugin catches up - the batches that
+    do not fit in maxspill bytes on disk are dropped'''
+    def __init__(self, name, maxsize, spilldir, segsize, maxspill):
+        self.cond = threading.Condition()
+        self.mem = deque() # the oldest batches
+        self.maxsize = maxsize
+        self.prefix = os.path.join(spilldir, 'ds-logpipe-%d-%s' % (os.getpid(), name))
+        self.segsize = segsize
+        self.maxspill = maxspill
+        self.seq = 0
+        self.segments = deque() # full segments, oldest first
+        self.wfile = None # the segment being written
+        self.wpath = None
+        self.wsize = 0
+        self.rfile = None # the segment being read
+        self.rpath = None
+        self.closed = False
+        # statistics
+        self.memlines = 0
+        self.diskbatches = 0
+        self.disklines = 0
+        self.diskbytes = 0
+        self.spilled = 0 # total number of lines spilled to disk
+        self.dropped = 0
+
+    def qsize(self):
+        with self.cond:
+            return len(self.mem) + self.diskbatches
+
+    def lag(self):
+        '''the number of lines waiting to be processed'''
+        with self.cond:
+            return self.memlines + self.disklines
+
+    def put(self, item, block=True, timeout=None):
+        '''never blocks - block and timeout are accepted like queue.Queue'''
+        with self.cond:
+            if item is None: # stop once the queue is empty
+                self.closed = True
+            elif self.diskbatches == 0 and len(self.mem) < self.maxsize:
+                self.mem.append(item)
+                self.memlines += len(item[1])
+            else: # keep spilling until the plugin reads back everything on disk
+                self.spill(item)
+            self.cond.notify()
+
+    def spill(self, item):
+        (queued, lines) = item
+        data = encode_batch(lines)
+        if self.diskbytes + len(data) > self.maxspill:
+            self.dropped += len(lines)
+            return
+        if self.wfile is None:
+            self.seq += 1
+            self.wpath = "%s-%d.spill" % (self.prefix, self.seq)
+            self.wfile = open(self.wpath, 'wb')
+            self.wsize = 0
+        header = ("%f %d\n" % (queued, len(data))).encode('ascii')
+        self.wfile.write(header)
+        self.wfile.write(data)
+        self.wsize += len(header) + len(data)
+        self.diskbatches += 1
+        self.disklines += len(lines)
+        self.diskbytes += len(data)
+        self.spilled += len(lines)
+        if self.wsize >= self.segsize:
+            self.rotate()
+
+    def rotate(self):
+        '''the segment being written is full, or it needs to be read'''
+        self.wfile.close()
+        self.segments.append(self.wpath)
+        self.wfile = None
+
+    def unspill(self):
+        '''read back the oldest batch on disk - the segments are
+        removed once they are read'''
+        header = None
+        while not header:
+            if self.rfile is None:
+                if not self.segments:
+                    self.rotate()
+                self.rpath = self.segments.popleft()
+                self.rfile = open(self.rpath, 'rb')
+            header = self.rfile.readline()
+            if not header: # end of the segment
+                self.rfile.close()
+                os.unlink(self.rpath)
+                self.rfile = None
+        (queued, size) = header.split()
+        data = self.rfile.read(int(size))
+        lines = decode_batch(data)
+        self.diskbatches -= 1
+        self.disklines -= len(lines)
+        self.diskbytes -= len(data)
+        return (float(queued), lines)
+
+    def get(self):
+        with self.cond:
+            while not self.mem and not self.diskbatches and not self.closed:
+                self.cond.wait()
+            if self.mem:
+                item = self.mem.popleft()
+                self.memlines -= len(item[1])
+                return item
+            if self.diskbatches:
+                return self.unspill()
+            self.cleanup()
+            return None
+
+    def cleanup(self):
+        for fobj, path in ((self.rfile, self.rpath), (self.wfile, self.wpath)):
+            if fobj is not None:
+                fobj.close()
+                os.unlink(path)
+        self.rfile = None
+        self.wfile = None
+        for path in self.segments:
+            os.unlink(path)
+        self.segments.clear()
+
+    def stats(self):
+        return ("spilled %d lines, %d lines (%d bytes) on disk, dropped %d lines, lag %d lines" %
+                (self.spilled, self.disklines, self.diskbytes, self.dropped, self.lag()))
+
+class PluginWorker(object):
+    '''run a plugin batch function in its own thread - the reader
+    only adds the batches of lines to the bounded queue of each plugin,
+    so a slow plugin does not hold up the reading of the pipe until its
+    queue is full - or never, if the queue spills to disk'''
+    def __init__(self, plgfunc, queuesize, tag=''):
+        self.plgfunc = plgfunc
+        self.tag = tag
+        if spilldir:
+            self.queue = SpillQueue(self.name(), queuesize, spilldir, spillsegsize, spillmax)
+        else:
+            self.queue = queue.Queue(queuesize)
+        self.aborted = False # the plugin returned False
+        self.failed = False # the plugin raised an exception
+        # statistics
+        self.lines = 0
+        self.batches = 0
+        self.busytime = 0.0 # time spent in the plugin
+        self.maxbusytime = 0.0
+        self.latency = 0.0 # time from queueing to the end of processing
+        self.maxlatency = 0.0
+        self.maxdepth = 0
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def name(self):
+        return "%s.%s%s" % (self.plgfunc.__module__, self.plgfunc.__name__, self.tag)
+
+    def put(self, lines):
+        if self.aborted or self.failed: # drop the lines, the plugin does not want any more
+            return
+        self.queue.put((time.time(), lines)) # blocks when the queue is full
+        depth = self.queue.qsize()
+        if depth > self.maxdepth:
+            self.maxdepth = depth
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is None: # stop
+                break
+            if self.aborted or self.failed: # drain the queue
+                continue
+            (queued, lines) = item
+            start = time.time()
+            try:
+                if not self.plgfunc(lines):
+                    self.aborted = True
+            except Exception as e:
+                # keep draining the queue, so the reader never blocks on it, and
+                # keep reading the pipe for the other plugins
+                print("Error: plugin %s failed: %s - its lines are dropped" % (self.name(), e))
+                traceback.print_exc()
+                sys.stdout.flush()
+                self.failed = True
+            end = time.time()
+            self.lines += len(lines)
+            self.batches += 1
+            self.busytime += end - start
+            self.maxbusytime = max(self.maxbusytime, end - start)
+            self.latency += end - queued
+            self.maxlatency = max(self.maxlatency, end - queued)
+
+    def stop(self):
+        '''process what is left in the queue, and stop the thread - do not
+        wait more than stoptimeout seconds for a stuck plugin'''
+        if not self.thread.is_alive():
+            return
+        try:
+            self.queue.put(None, timeout=stoptimeout)
+        except queue.Full:
+            print("Error: plugin %s did not process its queue in %d seconds" % (self.name(), stoptimeout))
+            return
+        self.thread.join(stoptimeout)
+        if self.thread.is_alive():
+            print("Error: plugin %s did not finish in %d seconds" % (self.name(), stoptimeout))
+
+    def stats(self):
+        batches = self.batches or 1
+        stats = ("%s: %d lines in %d batches, queue depth %d (max %d), "
+                 "batch processing time avg %.3fms max %.3fms, latency avg %.3fms max %.3fms" %
+                 (self.name(), self.lines, self.batches, self.queue.qsize(), self.maxdepth,
+                  self.busytime * 1000 / batches, self.maxbusytime * 1000,
+                  self.latency * 1000 / batches, self.maxlatency * 1000))
+        if spilldir:
+            stats += ", " + self.queue.stats()
+        if self.failed:
+            stats += ", failed"
+        return stats
+
+def printstats():
+    for worker in workers:
+        print(worker.stats())
+    sys.stdout.flush()
 
 def finish():
+    # let the plugin threads process the lines already read
+    for worker in workers: worker.stop()
+    printstats()
     for postfunc in plgpostfuncs: postfunc()
     if options.scriptpidfile: os.unlink(options.scriptpidfile)
     sys.exit(0)
@@ -55,7 +339,11 @@ def sighandler(signum, frame):
         if signum == signal.SIGALRM and debug:
             print("script timed out waiting to open pipe")
         finish()
-    else: printbuffer()
+    else:
+        printbuffer()
+        for pipe in pipes:
+            pipe.printbuffer()
+        printstats()
 
 def isvalidpluginfile(plg):
     return os.path.isfile(plg)
@@ -71,17 +359,36 @@ def my_import(plgfile):
     (dir, fname) = os.path.split(plgfile)
     base = os.path.splitext(fname)[0]
     if not dir: dir = "."
-    sys.path.insert(0, dir) # put our path first so it will find our file
-    mod = __import__(base) # will throw exception if problem with python file
-    sys.path.pop(0) # remove our path
-
-    # check for the plugin functions
+    if os.path.abspath(plgfile) in plgfiles:
+        # the same plugin used with another pipe gets its own module, so it
+        # does not share its functions and global variables with the first one
+        mod = types.ModuleType(base)
+        mod.__file__ = plgfile
+        plgf = open(plgfile)
+        try:
+            exec(compile(plgf.read(), plgfile, 'exec'), mod.__dict__)
+        finally:
+            plgf.close()
+    else:
+        sys.path.insert(0, dir) # put our path first so it will find our file
+        mod = __import__(base) # will throw exception if problem with python file
+        sys.path.pop(0) # remove our path
+        plgfiles.add(os.path.abspath(plgfile))
+
+    # check for the plugin functions - a plugin may process a batch
+    # of lines at a time with plugin_batch, instead of plugin
+    plgbatchfunc = getattr(mod, 'plugin_batch', None)
     plgfunc = getattr(mod, 'plugin', None)
-    if not plgfunc:
+    if not plgfunc and not plgbatchfunc:
         return ('%s does not specify a plugin function' % plgfile, None, base)
-    if not isinstance(plgfunc, types.FunctionType):
+    if plgbatchfunc:
+        if not isinstance(plgbatchfunc, types.FunctionType):
+            return ('the symbol "plugin_batch" in %s is not a function' % plgfile, None, base)
+        plgfuncs.append(plgbatchfunc) # add to list in cmd line order
+    elif not isinstance(plgfunc, types.FunctionType):
         return ('the symbol "plugin" in %s is not a function' % plgfile, None, base)
-    plgfuncs.append(plgfunc) # add to list in cmd line order
+    else:
+        plgfuncs.append(batchplugin(plgfunc)) # add to list in cmd line order
 
     # check for 'post' func
     plgpostfunc = getattr(mod, 'post', None)
@@ -105,16 +412,23 @@ def parse_plugins(parser, options, args):
     that is, each argument to plugin X will be specified as X.arg=value'''
     if not options.plugins: return args
 
+    plgargs = args # a plugin given several times gets its arguments each time
     for plgfile in options.plugins:
+        # --plugin=/path/to/pipe:/path/to/plugin.py only uses the plugin
+        # with that pipe, when watching several pipes
+        plgpipe = None
+        if ':' in plgfile:
+            (plgpipe, plgfile) = plgfile.split(':', 1)
         (errstr, prefunc, base) = my_import(plgfile)
         if errstr:
             parser.error(errstr)
             return args
+        if plgpipe:
+            plgpipes[plgfuncs[-1]] = os.path.abspath(plgpipe)
 
         # parse the arguments to the plugin given on the command line
         bvals = {} # holds plugin args and values, if any
-        newargs = []
-        for arg in args:
+        for arg in plgargs:
             if arg.startswith(base + '.'):
                 argval = arg.replace(base + '.', '')
                 (plgarg, plgval) = argval.split('=', 1) # split at first =
@@ -124,14 +438,12 @@ def parse_plugins(parser, options, args):
                     bvals[plgarg].append(plgval)
                 else: # convert to list
                     bvals[plgarg] = [bvals[plgarg], plgval]
-            else:
-                newargs.append(arg)
         if prefunc:
             if debug:
                 print('Calling "pre" function in', plgfile)
             if not prefunc(bvals):
                 parser.error('the "pre" function in %s returned an error' % plgfile)
-        args = newargs
+        args = [arg for arg in args if not arg.startswith(base + '.')]
 
     return args
 
@@ -140,7 +452,7 @@ def open_pipe(logfname):
     logf = None
     while not opencompleted:
         try:
-            logf = open(logfname, 'r') # blocks until there is some input
+            logf = open(logfname, 'rb', 0) # blocks until there is some input
             opencompleted = True
         except IOError as e:
             if e.errno == errno.EINTR:
@@ -208,41 +520,220 @@ def handle_script_pidfile(scriptpidfile):
         write_pid_file(scriptpidfile)
     return True
 
-def read_and_process_line(logf, plgfuncs):
-    line = None
-    done = False
+def decode_lines(data):
+    '''split a chunk of complete lines - the lines keep their newline'''
+    if sys.version_info >= (3, 0):
+        data = data.decode('utf-8', 'replace')
+    return [line + '\n' for line in data.split('\n')[:-1]]
+
+def split_lines(partial, data):
+    '''split a chunk read from a pipe into lines, return the lines and the
+    last line if it is not complete yet'''
+    data = partial + data
+    end = data.rfind(b'\n') + 1
+    return (decode_lines(data[:end]), data[end:])
+
+def read_lines(logf, partial):
+    '''read whatever is available in the pipe, up to readsize bytes, and
+    split it into lines - the last line may not be complete yet, it is
+    returned as the new partial line to prepend to the next chunk
+    returns (None, partial) at EOF'''
+    data = None
     readcompleted = False
     while not readcompleted:
         try:
-            line = logf.readline()
+            data = os.read(logf.fileno(), readsize)
             readcompleted = True # read completed
-        except IOError as e:
+        except (IOError, OSError) as e:
             if e.errno == errno.EINTR:
                 continue # read was interrupted, try again
             else: # hard error
                 print("%s [%d]" % (e.strerror, e.errno))
                 sys.exit(1)
-    if line: # read something
-        for plgfunc in plgfuncs:
-            if not plgfunc(line):
-                print("Aborting processing due to function %s.%s" % (plgfunc.__module__, plgfunc.__name__))
-                finish() # this will exit the process
-                done = True
+    if not data: # EOF
+        if partial: # last line had no newline
+            if sys.version_info >= (3, 0):
+                partial = partial.decode('utf-8', 'replace')
+            return ([partial], None)
+        return (None, partial)
+    return split_lines(partial, data)
+
+def process_lines(lines, plgfuncs, plgworkers=None):
+    '''pass a batch of lines to each plugin in turn, or to the
+    queue of each plugin thread'''
+    if plgworkers is None:
+        plgworkers = workers
+    for worker in plgworkers:
+        if worker.aborted:
+            print("Aborting processing due to function %s" % worker.name())
+            finish() # this will exit the process
+            return False
+        worker.put(lines)
+    if plgworkers:
+        return True
+    for plgfunc in plgfuncs:
+        if not plgfunc(lines):
+            print("Aborting processing due to function %s.%s" % (plgfunc.__module__, plgfunc.__name__))
+            finish() # this will exit the process
+            return False
+    return True
+
+def read_and_process_lines(logf, plgfuncs):
+    '''read and process the lines until EOF, or until a plugin
+    returns failure - return the number of lines read'''
+    nlines = 0
+    partial = b''
+    while partial is not None:
+        (lines, partial) = read_lines(logf, partial)
+        if lines is None: # EOF
+            break
+        if not lines: # no complete line yet
+            continue
+        nlines += len(lines)
+        if not process_lines(lines, plgfuncs):
+            break
+    return nlines
+
+class LogPipe(object):
+    '''a named pipe watched by the event loop, with its own plugin chain -
+    the pipe is opened for writing too, so that it stays open when the
+    server closes and reopens its log'''
+    def __init__(self, path, plgfuncs):
+        self.path = path
+        self.plgfuncs = plgfuncs
+        self.workers = []
+        self.rfd = None
+        self.wfd = None
+        self.partial = b''
+        self.buffer = None
+        self.totallines = 0
+        if not plgfuncs: # default plugin - a circular buffer for this pipe
+            self.buffer = deque(maxlen=maxlines)
+            self.plgfuncs = [self.defaultplugin_batch]
+
+    def defaultplugin_batch(self, lines):
+        self.buffer.extend(lines)
+        self.totallines += len(lines)
+        return True
+
+    def printbuffer(self):
+        if self.buffer is None:
+            return
+        sys.stdout.writelines(list(self.buffer))
+        print("Read %d total lines" % self.totallines)
+        print(self.path, "=" * 60)
+        sys.stdout.flush()
+
+    def open(self):
+        # a non blocking open for reading does not wait for a writer
+        self.rfd = os.open(self.path, os.O_RDONLY | os.O_NONBLOCK)
+        self.wfd = os.open(self.path, os.O_WRONLY | os.O_NONBLOCK)
+
+    def read(self):
+        '''read and process whatever is available in the pipe, return
+        False if there is nothing to read'''
+        try:
+            data = os.read(self.rfd, readsize)
+        except OSError as e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                return False
+            print("%s [%d]" % (e.strerror, e.errno))
+            sys.exit(1)
+        if not data:
+            return False
+        (lines, self.partial) = split_lines(self.partial, data)
+        if lines:
+            process_lines(lines, self.plgfuncs, self.workers)
+        return True
+
+    def close(self):
+        while self.read(): # what the server wrote before exiting
+            pass
+        if self.partial: # last line had no newline
+            process_lines(decode_lines(self.partial + b'\n'), self.plgfuncs, self.workers)
+            self.partial = b''
+        os.close(self.wfd)
+        os.close(self.rfd)
+
+def watch_pipes(pipes):
+    '''read several pipes from a single event loop - since the pipes never
+    reach EOF, the server process is checked every second instead'''
+    sel = selectors.DefaultSelector()
+    for pipe in pipes:
+        pipe.open()
+        sel.register(pipe.rfd, selectors.EVENT_READ, pipe)
+        if debug:
+            print("opened pipe", pipe.path)
+
+    serverpid = options.serverpid
+    started = time.time()
+    while True:
+        for (key, events) in sel.select(1.0):
+            key.data.read()
+        if not serverpid and options.serverpidfile:
+            # see if the server has written its server pid file yet
+            serverpid = get_pid_from_file(options.serverpidfile)
+            if not serverpid and time.time() - started > options.servertimeout:
+                if debug:
+                    print("script timed out waiting for the server pid file")
                 break
-    else: # EOF
-        done = True
-    return done
+        if serverpid and not is_proc_alive(serverpid):
+            if debug:
+                print("server pid", serverpid, "exited - script exiting")
+            break
+
+    for pipe in pipes:
+        sel.unregister(pipe.rfd)
+        pipe.close()
+    sel.close()
+
+def create_pipe(logfname):
+    try:
+        if os.stat(logfname).st_mode & S_IFIFO:
+            if debug:
+                print("Using existing log pipe", logfname)
+        else:
+            print("Error:", logfname, "exists and is not a log pipe")
+            print("use a filename other than", logfname)
+            sys.exit(1)
+    except OSError as e:
+        if e.errno == errno.ENOENT:
+            if debug:
+                print("Creating log pipe", logfname)
+            try:
+                os.mkfifo(logfname)
+                os.chmod(logfname, 0o600)
+            except Exception as e:
+                print("Failed to create log pipe: " + str(e))
+                sys.exit(1)
+        else:
+            print("Failed to create log pipe - %s [error %d]" % (e.strerror, e.errno))
+            sys.exit(1)
 
 def parse_options():
     from optparse import OptionParser
-    usage = "%prog <name of pipe> [options]"
+    usage = "%prog <name of pipe> [<name of pipe> ...] [options]"
     parser = OptionParser(usage)
     parser.add_option("-m", "--maxlines", dest="maxlines", type='int',
                       help="maximum number of lines to keep in the buffer", default=1000)
+    parser.add_option("-b", "--readsize", dest="readsize", type='int',
+                      help="maximum number of bytes to read from the pipe at a time", default=65536)
+    parser.add_option("--threaded", dest="threaded", action="store_true", default=False,
+                      help="run each plugin in its own thread, the pipe is read into a queue for each plugin")
+    parser.add_option("-q", "--queuesize", dest="queuesize", type='int',
+                      help="maximum number of batches of lines queued for each plugin thread", default=1000)
+    parser.add_option("--spilldir", type='string', dest='spilldir',
+                      help="directory where the lines are spilled when a plugin thread queue is full, implies --threaded")
+    parser.add_option("--spillsegsize", dest="spillsegsize", type='int',
+                      help="size in megabytes of each spill file", default=64)
+    parser.add_option("--spillmax", dest="spillmax", type='int',
+                      help="maximum size in megabytes of the spill files of each plugin, "
+                      "the lines that do not fit are dropped", default=1024)
     parser.add_option("-d", "--debug", dest="debug", action="store_true",
                       default=False, help="gather extra debugging information")
     parser.add_option("-p", "--plugin", type='string', dest='plugins', action='append',
-                      help='filename of a plugin to use with this log')
+                      help='filename of a plugin to use with this log - use pipe:plugin to only use '
+                      'the plugin with one of the pipes')
     parser.add_option("-s", "--serverpidfile", type='string', dest='serverpidfile',
                       help='name of file containing the pid of the server to monitor')
     parser.add_option("-t", "--servertimeout", dest="servertimeout", type='int',
@@ -258,22 +749,60 @@ def parse_options():
 
     args = parse_plugins(parser, options, args)
 
+    if options.spilldir and not os.path.isdir(options.spilldir):
+        parser.error("the spill directory %s does not exist" % options.spilldir)
+
     if len(args) < 1:
         parser.error("You must specify the name of the pipe to use")
-    if len(args) > 1:
-        parser.error("error - unhandled command line arguments: %s" % ' '.join(args))
+    unhandled = [arg for arg in args if '=' in arg]
+    if unhandled:
+        parser.error("error - unhandled command line arguments: %s" % ' '.join(unhandled))
+    if len(args) > 1 and not selectors:
+        parser.error("error - watching several pipes requires python 3")
+    for plgpipe in plgpipes.values():
+        if plgpipe not in [os.path.abspath(arg) for arg in args]:
+            parser.error("error - the plugin pipe %s is not one of the pipes to use" % plgpipe)
 
-    return options, args[0]
+    return options, args
 
-options, logfname = parse_options()
+options, logfnames = parse_options()
+logfname = logfnames[0]
 
 if options.debug:
     debug = True
 
-if len(plgfuncs) == 0:
-    plgfuncs.append(defaultplugin)
+maxlines = options.maxlines
+readsize = options.readsize
+queuesize = options.queuesize
+spilldir = options.spilldir
+spillsegsize = options.spillsegsize * 1024 * 1024
+spillmax = options.spillmax * 1024 * 1024
+buffer = deque(maxlen=maxlines)
+
+if len(logfnames) > 1:
+    # each pipe gets the plugins given for it, or for all the pipes - a
+    # plugin used with several pipes still runs in a single thread
+    plgworkers = {}
+    for (idx, path) in enumerate(logfnames):
+        pipefuncs = [plgfunc for plgfunc in plgfuncs
+                     if plgpipes.get(plgfunc, os.path.abspath(path)) == os.path.abspath(path)]
+        pipe = LogPipe(path, pipefuncs)
+        if options.threaded or spilldir:
+            for plgfunc in pipe.plgfuncs:
+                if plgfunc not in plgworkers:
+                    plgworkers[plgfunc] = PluginWorker(plgfunc, queuesize, "-%d" % idx)
+                    workers.append(plgworkers[plgfunc])
+                pipe.workers.append(plgworkers[plgfunc])
+        pipes.append(pipe)
+elif len(plgfuncs) == 0:
+    plgfuncs.append(defaultplugin_batch)
+if len(logfnames) == 1 and (options.threaded or spilldir):
+    workers = [PluginWorker(plgfunc, queuesize) for plgfunc in plgfuncs]
 if len(plgpostfuncs) == 0:
     plgpostfuncs.append(defaultpost)
+# a pipe using the default plugin prints its own buffer, even when the
+# plugins of the other pipes have a post func
+plgpostfuncs.extend([pipe.printbuffer for pipe in pipes if pipe.buffer is not None])
 
 if options.user:
     try:
@@ -298,30 +827,11 @@ if serverpid:
         print("Server pid [%d] is not alive - exiting" % serverpid)
         sys.exit(1)
 
-try:
-    if os.stat(logfname).st_mode & S_IFIFO:
-        if debug:
-            print("Using existing log pipe", logfname)
-    else:
-        print("Error:", logfname, "exists and is not a log pipe")
-        print("use a filename other than", logfname)
-        sys.exit(1)
-except OSError as e:
-    if e.errno == errno.ENOENT:
-        if debug:
-            print("Creating log pipe", logfname)
-        try:
-            os.mkfifo(logfname)
-            os.chmod(logfname, 0o600)
-        except Exception as e:
-            print("Failed to create log pipe: " + str(e))
-            sys.exit(1)
-    else:
-        print("Failed to create log pipe - %s [error %d]" % (e.strerror, e.errno))
-        sys.exit(1)
+for path in logfnames:
+    create_pipe(path)
 
 if debug:
-    print("Listening to log pipe", logfname, "number of lines", maxlines)
+    print("Listening to log pipe", ' '.join(logfnames), "number of lines", maxlines)
 
 # set up our signal handlers
 signal.signal(signal.SIGHUP, sighandler)
@@ -330,6 +840,10 @@ signal.signal(signal.SIGINT, sighandler)
 signal.signal(signal.SIGTERM, sighandler)
 signal.signal(signal.SIGALRM, sighandler)
 
+if pipes:
+    watch_pipes(pipes)
+    finish()
+
 timerisset = False
 neverdone = False
 if options.serverpidfile:
@@ -361,17 +875,16 @@ while not done:
         if debug:
             print("cancelled startup timer")
 
-    lines = 0
-    # read and process the next line in the pipe
+    # read and process the lines in the pipe, a chunk at a time
     # if server exits while we are reading, we will get
-    # EOF and the func will return True - will also
-    # return True if a plugin returns failure
-    while not read_and_process_line(logf, plgfuncs):
-        lines += 1
+    # EOF and the func will return - will also
+    # return if a plugin returns failure
+    lines = read_and_process_lines(logf, plgfuncs)
 
     # the other end of the pipe closed - we close our end too
     if debug:
         print("read", lines, "lines")
+        printstats()
     logf.close()
     logf = None
     if debug:
@@ -1,6 +1,9 @@
 import re
 import sys
 import os, os.path
+import time
+import threading
+from collections import OrderedDict
 
 # regex that matches a BIND request line
 regex_num = r'[-]?\d+' # matches numbers including negative
@@ -12,6 +15,15 @@ regex_unbind = re.compile(r'^\[.+\] (conn=%s) op=%s UNBIND' % (regex_num, regex_
 regex_closed = re.compile(r'^(\[.+\]) (conn=%s) (op=%s) fd=%s closed' % (regex_num, regex_num, regex_num))
 regex_ssl_map_fail = re.compile(r'^\[.+\] (conn=%s) (SSL failed to map client certificate.*)$' % regex_num)
 
+# a line can only match a regex if it contains the literal - most of the
+# access log lines are rejected with these checks, without running any regex
+literal_new_conn = 'connection from '
+literal_sslinfo = ' SSL '
+literal_bind_req = ' BIND dn='
+literal_bind_res = ' tag=97 '
+literal_unbind = ' UNBIND'
+literal_closed = ' closed'
+
 # bind errors we can ignore
 ignore_errors = {'0': 'Success',
                  '10': 'Referral',
@@ -28,8 +40,9 @@ class Conn:
         self.slot = slot
         self.ip = ip
         self.timestamp = timestamp
-        self.ops = {}
+        self.ops = OrderedDict()
         self.sslinfo = ''
+        self.lastseen = time.time()
 
     def addssl(self, sslinfo):
         if self.sslinfo and sslinfo:
@@ -51,7 +64,7 @@ class Conn:
             if not mech: mech = "SIMPLE"
             op[REQ] = {'dn': dn, 'method': method, 'timestamp': timestamp,
                        'mech': mech}
-            self.ops[opnum] = op
+            self.addop(opnum, op)
         return retval
 
     def addres(self, timestamp, opnum, errnum):
@@ -65,9 +78,15 @@ class Conn:
         else: # result came before request in access log - store until we find request
             op = [None, None] # new empty list
             op[RES] = {'errnum': errnum, 'timestamp': timestamp}
-            self.ops[opnum] = op
+            self.addop(opnum, op)
         return retval
 
+    def addop(self, opnum, op):
+        # an op whose request or result was missed would stay forever
+        self.ops[opnum] = op
+        while len(self.ops) > maxops:
+            self.ops.popitem(last=False) # drop the oldest
+
     def logstr(self, opnum, op):
         # timestamp connnum opnum err=X request timestamp dn=Y method=Z mech=W timestamp ip=ip
         logstr = '%s %s %s err=%s REQUEST %s dn=%s method=%s mech=%s %s ip=%s extra=%s' % (
@@ -83,93 +102,153 @@ class Conn:
 #  value is list
 #    list[0] is BIND request
 #    list[1] is RESULT
-conns = {}
+# the least recently used conn is first - the conns whose close line was
+# missed are evicted when there are too many, or when they are too old
+conns = OrderedDict()
+maxconns = 100000 # set with failedbinds.maxconns
+conntimeout = 3600 # seconds, set with failedbinds.conntimeout
+maxops = 10 # pending ops per conn, set with failedbinds.maxops
 
 # file to log failed binds to
 logf = None
+loglock = threading.Lock()
+flushinterval = 1.0 # seconds, set with failedbinds.flushinterval
+flushevent = threading.Event() # set to stop the flush thread
+flushthread = None
+dirty = False # something was written since the last flush
+
+def flusher():
+    '''flush the log file every flushinterval seconds, if needed - the
+    failed binds are written to the file buffer, and never wait for the disk'''
+    global dirty
+    while not flushevent.wait(flushinterval):
+        with loglock:
+            if dirty:
+                logf.flush()
+                dirty = False
+
+def writelog(logmsg):
+    global dirty
+    with loglock:
+        logf.write(logmsg + "\n")
+        dirty = True
 
 def pre(plgargs):
-    global logf
+    global logf, flushthread, flushinterval, maxconns, conntimeout, maxops
     logfile = plgargs.get('logfile', None)
     if not logfile:
         print("Error: missing required argument failedbinds.logfile")
         return False
+    try:
+        flushinterval = float(plgargs.get('flushinterval', flushinterval))
+        maxconns = int(plgargs.get('maxconns', maxconns))
+        conntimeout = float(plgargs.get('conntimeout', conntimeout))
+        maxops = int(plgargs.get('maxops', maxops))
+    except ValueError as e:
+        print("Error: invalid failedbinds argument: %s" % str(e))
+        return False
     needchmod = False
     if not os.path.isfile(logfile): needchmod = True
-    if sys.version_info < (3, 0):
-        logf = open(logfile, 'a', 0) # 0 for unbuffered output
-    else:
-        logf = open(logfile, 'a')
+    logf = open(logfile, 'a')
     if needchmod: os.chmod(logfile, 0o600)
+    flushthread = threading.Thread(target=flusher)
+    flushthread.daemon = True
+    flushthread.start()
     return True
 
 def post():
     global logf
+    flushevent.set()
+    flushthread.join()
     logf.close()
     logf = None
 
+def getconn(connid, create=False):
+    '''return the conn, and make it the most recently used one - evict the
+    conns that are too old, or the least recently used ones if there are
+    too many'''
+    now = time.time()
+    conn = conns.pop(connid, None)
+    if conn is None and create:
+        # should have seen new conn line - if not, have to create a dummy one
+        conn = Conn('unknown', connid, '', '', 'unknown')
+    if conn is not None:
+        conn.lastseen = now
+        conns[connid] = conn
+    while conns:
+        oldest = next(iter(conns.values()))
+        if len(conns) <= maxconns and now - oldest.lastseen <= conntimeout:
+            break
+        conns.popitem(last=False)
+    return conn
+
 def plugin(line):
     # is this a new conn line?
-    match = regex_new_conn.match(line)
-    if match:
-        (timestamp, connid, fdid, slotid, ip) = match.groups()
-        if connid in conns: conns.pop(connid) # remove old one, if any
-        conn = Conn(timestamp, connid, fdid, slotid, ip)
-        conns[connid] = conn
-        return True
+    if literal_new_conn in line:
+        match = regex_new_conn.match(line)
+        if match:
+            (timestamp, connid, fdid, slotid, ip) = match.groups()
+            if connid in conns: conns.pop(connid) # remove old one, if any
+            conn = Conn(timestamp, connid, fdid, slotid, ip)
+            conns[connid] = conn
+            getconn(connid)
+            return True
 
     # is this an UNBIND line?
-    match = regex_unbind.match(line)
-    if match:
-        connid = match.group(1)
-        if connid in conns: conns.pop(connid) # remove it
-        return True
+    if literal_unbind in line:
+        match = regex_unbind.match(line)
+        if match:
+            connid = match.group(1)
+            if connid in conns: conns.pop(connid) # remove it
+            return True
 
     # is this a closed line?
-    match = regex_closed.match(line)
-    if match:
-        (timestamp, connid, opid) = match.groups()
-        if connid in conns: conns.pop(connid) # remove it
-        return True
-
-    # is this an SSL info line?
-    match = regex_sslinfo.match(line)
-    if match:
-        (connid, sslinfo) = match.groups()
-        if connid in conns:
-            conns[connid].addssl(sslinfo)
-        return True
-
-    # is this a line with extra SSL mapping info?
-    match = regex_ssl_map_fail.match(line)
-    if match:
-        (connid, sslinfo) = match.groups()
-        if connid in conns:
-            conns[connid].addssl(sslinfo)
-        return True
+    if literal_closed in line:
+        match = regex_closed.match(line)
+        if match:
+            (timestamp, connid, opid) = match.groups()
+            if connid in conns: conns.pop(connid) # remove it
+            return True
+
+    if literal_sslinfo in line:
+        # is this an SSL info line?
+        match = regex_sslinfo.match(line)
+        if match:
+            (connid, sslinfo) = match.groups()
+            conn = getconn(connid)
+            if conn:
+                conn.addssl(sslinfo)
+            return True
+
+        # is this a line with extra SSL mapping info?
+        match = regex_ssl_map_fail.match(line)
+        if match:
+            (connid, sslinfo) = match.groups()
+            conn = getconn(connid)
+            if conn:
+                conn.addssl(sslinfo)
+            return True
 
     # is this a REQUEST line?
-    match = regex_bind_req.match(line)
-    if match:
-        (timestamp, connid, opnum, dn, method, mech) = match.groups()
-        # should have seen new conn line - if not, have to create a dummy one
-        conn = conns.get(connid, Conn('unknown', connid, '', '', 'unknown'))
-        logmsg = conn.addreq(timestamp, opnum, dn, method, mech)
-        if logmsg:
-            logf.write(logmsg + "\n")
-            logf.flush()
-        return True
+    if literal_bind_req in line:
+        match = regex_bind_req.match(line)
+        if match:
+            (timestamp, connid, opnum, dn, method, mech) = match.groups()
+            conn = getconn(connid, create=True)
+            logmsg = conn.addreq(timestamp, opnum, dn, method, mech)
+            if logmsg:
+                writelog(logmsg)
+            return True
 
     # is this a RESULT line?
-    match = regex_bind_res.match(line)
-    if match:
-        (timestamp, connid, opnum, errnum) = match.groups()
-        # should have seen new conn line - if not, have to create a dummy one
-        conn = conns.get(connid, Conn('unknown', connid, '', '', 'unknown'))
-        logmsg = conn.addres(timestamp, opnum, errnum)
-        if logmsg:
-            logf.write(logmsg + "\n")
-            logf.flush()
-        return True
+    if literal_bind_res in line:
+        match = regex_bind_res.match(line)
+        if match:
+            (timestamp, connid, opnum, errnum) = match.groups()
+            conn = getconn(connid, create=True)
+            logmsg = conn.addres(timestamp, opnum, errnum)
+            if logmsg:
+                writelog(logmsg)
+            return True
 
     return True # no match
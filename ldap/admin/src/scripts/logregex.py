@@ -1,28 +1,55 @@
 import sys
 import re
 import __main__ # to use globals
+try:
+    from lib389.dirsrv_log import get_required_literals
+except ImportError:
+    # without lib389 every line is checked with the regexes
+    def get_required_literals(pattern, flags=0):
+        return []
 
 # supports more than one regex - multiple regex are combined using AND logic
 # OR logic is easily supported with the '|' regex modifier
 regex_regex_ary = []
+# the literal strings that a line must contain for all the regexes to match -
+# most lines are rejected with these, without running any regex
+regex_literals = []
 
 def pre(plgargs):
-    global regex_regex_ary
+    global regex_regex_ary, regex_literals
     regexary = plgargs.get('regex', None)
     if not regexary:
         print("Error: missing required argument logregex.regex")
         return False
-    if isinstance(regexary,list):
-        regex_regex_ary = [re.compile(xx) for xx in regexary]
-    else:
-        regex_regex_ary.append(re.compile(regexary))
+    if not isinstance(regexary,list):
+        regexary = [regexary]
+    regex_regex_ary = [re.compile(xx) for xx in regexary]
+    regex_literals = []
+    for rx in regex_regex_ary:
+        regex_literals.extend(get_required_literals(rx.pattern, rx.flags))
     return True
 
-def plugin(line):
-    __main__.totallines = __main__.totallines + 1
+def matches(line):
+    for literal in regex_literals:
+        if literal not in line:
+            return False
     for rx in regex_regex_ary:
         if not rx.search(line):
-            return True # regex did not match - get next line
-    else: # all regexes matched
-        __main__.totallines = __main__.totallines - 1
-        return __main__.defaultplugin(line)
+            return False
+    return True
+
+def plugin(line):
+    __main__.totallines = __main__.totallines + 1
+    if not matches(line):
+        return True # regex did not match - get next line
+    # all regexes matched
+    __main__.totallines = __main__.totallines - 1
+    return __main__.defaultplugin(line)
+
+def plugin_batch(lines):
+    matched = [line for line in lines if matches(line)]
+    __main__.totallines = __main__.totallines + len(lines) - len(matched)
+    for line in matched:
+        if not __main__.defaultplugin(line):
+            return False
+    return True
@@ -9,13 +9,16 @@
 """Helpers for managing the directory server internal logs.
 """
 
+import os
 import re
 import gzip
+import sqlite3
+from collections import OrderedDict
 from datetime import datetime
-from dateutil.parser import parse as dt_parse
+from dateutil.tz import tzoffset
 from glob import glob
 from lib389._constants import DN_CONFIG
-from lib389.utils import ensure_bytes, ensure_str
+from lib389.utils import ensure_str
 
 
 # Because many of these settings can change live, we need to check for certain
@@ -30,12 +33,449 @@ MONTH_LOOKUP = {
     'Jun': 6,
     'Jul': 7,
     'Aug': 8,
-    'Oct': 9,
-    'Sep': 10,
+    'Sep': 9,
+    'Oct': 10,
     'Nov': 11,
     'Dec': 12,
 }
 
+REGEX_QUANTIFIERS = '*+?{'
+ACCESS_INDEX_VERSION = 1
+REGEX_INLINE_FLAGS = 'aiLmsux'
+
+
+def _skip_regex_class(pattern, idx):
+    """Return the index after the character class that starts at idx"""
+    idx += 1
+    if idx < len(pattern) and pattern[idx] == '^':
+        idx += 1
+    if idx < len(pattern) and pattern[idx] == ']':
+        idx += 1
+    while idx < len(pattern) and pattern[idx] != ']':
+        idx += 2 if pattern[idx] == '\\' else 1
+    return idx + 1
+
+
+def _skip_regex_group(pattern, idx):
+    """Return the index after the group that starts at idx"""
+    depth = 0
+    while idx < len(pattern):
+        char = pattern[idx]
+        if char == '\\':
+            idx += 2
+            continue
+        if char == '[':
+            idx = _skip_regex_class(pattern, idx)
+            continue
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+            if depth == 0:
+                return idx + 1
+        idx += 1
+    return idx
+
+
+def get_required_literals(pattern, flags=0):
+    """Return the literal substrings that any string matching a regex must
+    contain.  Only the literals outside of groups and character classes are
+    found, so the list may be empty, but a line that does not contain one
+    of them can be rejected without running the regex.
+
+    @param pattern - a regex pattern
+    @param flags - the flags the pattern is compiled with
+    @return - a list of literal strings
+    """
+    if not isinstance(pattern, str) or flags & (re.IGNORECASE | re.VERBOSE):
+        return []
+    literals = []
+    run = []
+    idx = 0
+    while idx < len(pattern):
+        char = pattern[idx]
+        atom = None
+        if char == '\\':
+            if idx + 1 >= len(pattern):
+                return []
+            if pattern[idx + 1] in '0123456789xuUN':
+                # Octal, hex and named escapes, or group references
+                return []
+            if not pattern[idx + 1].isalnum():
+                # An escaped special character
+                atom = pattern[idx + 1]
+            idx += 2
+        elif char == '(':
+            if pattern.startswith('(?', idx) and idx + 2 < len(pattern) and \
+               pattern[idx + 2] in REGEX_INLINE_FLAGS:
+                end = re.match(r'\(\?([%s-]*)' % REGEX_INLINE_FLAGS, pattern[idx:])
+                if 'i' in end.group(1) or 'x' in end.group(1):
+                    return []
+            idx = _skip_regex_group(pattern, idx)
+        elif char == '[':
+            idx = _skip_regex_class(pattern, idx)
+        elif char == '|':
+            # Any of the alternatives may match
+            return []
+        elif char in '.^$' + REGEX_QUANTIFIERS:
+            idx += 1
+        else:
+            atom = char
+            idx += 1
+
+        if idx < len(pattern) and pattern[idx] in REGEX_QUANTIFIERS:
+            # The atom is only required if it must repeat at least once
+            if pattern[idx] == '{':
+                repeat = re.match(r'\{(\d+)(,\d*)?\}', pattern[idx:])
+                if repeat is None:
+                    return []
+                required = int(repeat.group(1)) > 0
+                idx += repeat.end()
+            else:
+                required = pattern[idx] == '+'
+                idx += 1
+            if idx < len(pattern) and pattern[idx] in '?+':
+                idx += 1
+            if atom is not None and required:
+                run.append(atom)
+            atom = None
+        if atom is not None:
+            run.append(atom)
+        else:
+            if run:
+                literals.append(''.join(run))
+            run = []
+    if run:
+        literals.append(''.join(run))
+    return sorted(literals, key=len, reverse=True)
+
+
+class LogMatcher(object):
+    """Match lines against several regexes at once.  The literals each regex
+    requires are checked first with fast substring tests, and the regex only
+    runs on the lines that contain all of them.
+    """
+    def __init__(self, patterns, search=False):
+        """Init the matcher
+        @param patterns - a list of regex patterns
+        @param search - search for the patterns anywhere in the lines,
+                        instead of matching them at the start of the lines
+        """
+        self.progs = []
+        for pattern in patterns:
+            prog = re.compile(pattern)
+            self.progs.append((pattern, prog.search if search else prog.match,
+                               get_required_literals(pattern, prog.flags)))
+
+    def matches(self, line):
+        """Return the patterns that match a line
+        @param line - a log line
+        @return - a list of patterns
+        """
+        results = []
+        for (pattern, match, literals) in self.progs:
+            for literal in literals:
+                if literal not in line:
+                    break
+            else:
+                if match(line):
+                    results.append(pattern)
+        return results
+
+
+def get_index_path(log):
+    """Return the location of the index of a log file, a hidden file next to
+    the log, so it is not mistaken for a rotated log
+    @param log - the log file location
+    @return - the index file location
+    """
+    log = ensure_str(log)
+    return os.path.join(os.path.dirname(log), '.%s.idx' % os.path.basename(log))
+
+
+class AccessLogIndex(object):
+    """A persistent index of an access log file, that maps the connections,
+    the operations, and the CSNs to the offsets of their lines in the log.
+    The index is stored next to the log (in memory if the log directory is
+    not writable), and only the lines added since the last update are
+    indexed.  The offsets of the "zipped" logs are the offsets in the
+    decompressed log.
+    """
+    prog_conn = re.compile(br'\[[^\]]*\] conn=(\d+)(?: op=(-?\d+))?')
+    prog_csn = re.compile(br' csn=(\w+)')
+    # The start of the log that is checked to detect a new log file
+    HEAD_SIZE = 4096
+    BATCH_LINES = 10000
+
+    def __init__(self, path):
+        """Open the index of a log
+        @param path - the log file location
+        """
+        self.path = ensure_str(path)
+        self.index_path = get_index_path(self.path)
+        try:
+            self.db = sqlite3.connect(self.index_path)
+            self._create()
+        except sqlite3.Error:
+            self.db = sqlite3.connect(':memory:')
+            self._create()
+
+    def _create(self):
+        """Create the tables of the index"""
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value);
+            CREATE TABLE IF NOT EXISTS ops (conn INTEGER, op INTEGER, offset INTEGER);
+            CREATE TABLE IF NOT EXISTS csns (csn TEXT, offset INTEGER);
+            CREATE INDEX IF NOT EXISTS ops_conn_op ON ops (conn, op);
+            CREATE INDEX IF NOT EXISTS csns_csn ON csns (csn);
+        """)
+
+    def _get_meta(self, name):
+        """Return a value saved with the index"""
+        row = self.db.execute('SELECT value FROM meta WHERE name = ?', (name,)).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def _set_meta(self, name, value):
+        """Save a value with the index"""
+        self.db.execute('INSERT OR REPLACE INTO meta (name, value) VALUES (?, ?)', (name, value))
+
+    def _open(self):
+        """Open the log in binary mode"""
+        if self.path.endswith('.gz'):
+            return gzip.open(self.path, 'rb')
+        return open(self.path, 'rb')
+
+    def update(self):
+        """Index the lines that were added to the log since the last update.
+        The index is rebuilt if the log is a new file (the log was rotated).
+        """
+        inode = os.stat(self.path).st_ino
+        with self._open() as lf:
+            head = lf.read(self.HEAD_SIZE)
+            offset = 0
+            indexed_head = self._get_meta('head')
+            if self._get_meta('version') == ACCESS_INDEX_VERSION and \
+               self._get_meta('inode') == inode and indexed_head is not None and \
+               head.startswith(bytes(indexed_head)):
+                offset = self._get_meta('offset')
+                if self.path.endswith('.gz'):
+                    # The "zipped" logs are rotated logs, they do not change
+                    return
+            else:
+                self.db.execute('DELETE FROM ops')
+                self.db.execute('DELETE FROM csns')
+            lf.seek(offset)
+            ops = []
+            csns = []
+            for line in lf:
+                if not line.endswith(b'\n'):
+                    # The server is still writing this line
+                    break
+                result = self.prog_conn.match(line)
+                if result:
+                    op = result.group(2)
+                    ops.append((int(result.group(1)), None if op is None else int(op), offset))
+                    if b' csn=' in line:
+                        for csn in self.prog_csn.findall(line):
+                            csns.append((ensure_str(csn), offset))
+                offset += len(line)
+                if len(ops) >= self.BATCH_LINES:
+                    self.db.executemany('INSERT INTO ops VALUES (?, ?, ?)', ops)
+                    self.db.executemany('INSERT INTO csns VALUES (?, ?)', csns)
+                    ops = []
+                    csns = []
+            self.db.executemany('INSERT INTO ops VALUES (?, ?, ?)', ops)
+            self.db.executemany('INSERT INTO csns VALUES (?, ?)', csns)
+            self._set_meta('version', ACCESS_INDEX_VERSION)
+            self._set_meta('inode', inode)
+            self._set_meta('head', sqlite3.Binary(head))
+            self._set_meta('offset', offset)
+            self.db.commit()
+
+    def _read_lines(self, cursor):
+        """Read the lines at the offsets returned by an index query"""
+        offsets = sorted(set(row[0] for row in cursor))
+        lines = []
+        if offsets:
+            with self._open() as lf:
+                for offset in offsets:
+                    lf.seek(offset)
+                    lines.append(ensure_str(lf.readline()))
+        return lines
+
+    def find_conn(self, conn):
+        """Return the lines of a connection
+        @param conn - a connection number
+        @return - a list of log lines
+        """
+        return self._read_lines(self.db.execute(
+            'SELECT offset FROM ops WHERE conn = ?', (int(conn),)))
+
+    def find_op(self, conn, op):
+        """Return the lines of an operation
+        @param conn - a connection number
+        @param op - an operation number
+        @return - a list of log lines
+        """
+        return self._read_lines(self.db.execute(
+            'SELECT offset FROM ops WHERE conn = ? AND op = ?', (int(conn), int(op))))
+
+    def find_csn(self, csn):
+        """Return the lines with a CSN
+        @param csn - a CSN string
+        @return - a list of log lines
+        """
+        return self._read_lines(self.db.execute(
+            'SELECT offset FROM csns WHERE csn = ?', (ensure_str(csn),)))
+
+
+class Operation(object):
+    """An operation of an access log: the request joined with its result"""
+    def __init__(self, conn, op):
+        """Init the operation
+        @param conn - the connection number
+        @param op - the operation number
+        """
+        self.conn = conn
+        self.op = op
+        # The request type (SRCH, MOD, BIND, ...), and its details (base,
+        # scope, filter, attrs, dn, method, ...)
+        self.action = None
+        self.request = {}
+        self.timestamp = None
+        self.result_timestamp = None
+        # The result of the operation, None until the RESULT line is read
+        self.err = None
+        self.tag = None
+        self.nentries = None
+        self.etime = None
+        self.notes = None
+        self.csn = None
+
+    @property
+    def complete(self):
+        """The request and the result of the operation were both found"""
+        return self.action is not None and self.result_timestamp is not None
+
+    def __repr__(self):
+        return '<Operation conn=%s op=%s %s err=%s etime=%s>' % (
+            self.conn, self.op, self.action, self.err, self.etime)
+
+
+class OperationTracker(object):
+    """Join the request lines of an access log with their RESULT lines, by
+    connection and operation.  Only the operations that are waiting for
+    their result are kept, a bounded number of them for a bounded number
+    of connections, and a connection is released when it is closed or
+    unbound.  The operations that are released without a result are
+    returned too, with no result.
+    """
+    prog_op = re.compile(r'^(?P<timestamp>\[[^\]]*\]) conn=(?P<conn>\d+) op=(?P<op>-?\d+) (?P<action>[A-Z]+)(?: (?P<rem>.*))?$')
+    prog_closed = re.compile(r'^(?P<timestamp>\[[^\]]*\]) conn=(?P<conn>\d+) op=-?\d+ fd=\d+ closed')
+    prog_value = re.compile(r'(\w+)=("[^"]*"|\S*)')
+    # The lines of an operation that are not requests
+    NOT_REQUESTS = ('ENTRY', 'REFERRAL', 'SORT', 'VLV')
+    # The requests that have no RESULT line
+    NO_RESULT = ('ABANDON', 'UNBIND')
+
+    def __init__(self, maxconns=10000, maxops=100):
+        """Init the tracker
+        @param maxconns - the number of connections to keep, the operations
+                          of the least recently used connection are released
+        @param maxops - the number of operations to keep for a connection,
+                        waiting for their result
+        """
+        self.maxconns = maxconns
+        self.maxops = maxops
+        self.conns = OrderedDict()
+
+    def _get_values(self, rem):
+        """Return the key=value pairs of a line as a dictionary"""
+        values = {}
+        for (key, value) in self.prog_value.findall(rem or ''):
+            if value.startswith('"'):
+                value = value[1:-1]
+            values[key] = value
+        return values
+
+    def _get_ops(self, conn, done):
+        """Return the operations waiting for their result on a connection"""
+        ops = self.conns.pop(conn, None)
+        if ops is None:
+            ops = OrderedDict()
+            if len(self.conns) >= self.maxconns:
+                done.extend(self.conns.popitem(last=False)[1].values())
+        self.conns[conn] = ops
+        return ops
+
+    def add(self, line):
+        """Add an access log line
+        @param line - an access log line
+        @return - a list of the operations that were completed, or released,
+                  by the line
+        """
+        done = []
+        result = self.prog_op.match(line.rstrip('\n'))
+        if result is None:
+            result = self.prog_closed.match(line)
+            if result is not None:
+                ops = self.conns.pop(result.group('conn'), None)
+                if ops:
+                    done.extend(ops.values())
+            return done
+
+        action = result.group('action')
+        if action in self.NOT_REQUESTS:
+            return done
+        conn = result.group('conn')
+        op = result.group('op')
+        ops = self._get_ops(conn, done)
+        if action == 'RESULT':
+            operation = ops.pop(op, None)
+            if operation is None:
+                # The request was not read (or was already released)
+                operation = Operation(conn, op)
+            values = self._get_values(result.group('rem'))
+            operation.result_timestamp = result.group('timestamp')
+            for key in ('err', 'tag', 'nentries'):
+                if key in values:
+                    setattr(operation, key, int(values[key]))
+            if 'etime' in values:
+                operation.etime = float(values['etime'])
+            operation.notes = values.get('notes')
+            operation.csn = values.get('csn')
+            done.append(operation)
+            return done
+
+        operation = Operation(conn, op)
+        operation.action = action
+        operation.request = self._get_values(result.group('rem'))
+        operation.timestamp = result.group('timestamp')
+        if action in self.NO_RESULT:
+            done.append(operation)
+            if action == 'UNBIND':
+                done.extend(self.conns.pop(conn).values())
+            return done
+        if op in ops:
+            # The operation number was reused, the server was restarted
+            done.append(ops.pop(op))
+        elif len(ops) >= self.maxops:
+            done.append(ops.popitem(last=False)[1])
+        ops[op] = operation
+        return done
+
+    def flush(self):
+        """Release all the operations waiting for their result
+        @return - a list of operations
+        """
+        done = []
+        for ops in self.conns.values():
+            done.extend(ops.values())
+        self.conns.clear()
+        return done
+
 
 class DirsrvLog(object):
     """Class of functions to working with the various DIrectory Server logs
@@ -46,108 +486,250 @@ class DirsrvLog(object):
         """
         self.dirsrv = dirsrv
         self.log = self.dirsrv.log
-        self.prog_timestamp = re.compile('\[(?P<day>\d*)\/(?P<month>\w*)\/(?P<year>\d*):(?P<hour>\d*):(?P<minute>\d*):(?P<second>\d*)(.(?P<nanosecond>\d*))+\s(?P<tz>[\+\-]\d*)')   # noqa
-        self.prog_datetime = re.compile('^(?P<timestamp>\[.*\])')
+        self.prog_timestamp = re.compile('\[(?P<day>\d*)\/(?P<month>\w*)\/(?P<year>\d*):(?P<hour>\d*):(?P<minute>\d*):(?P<second>\d*)(\.(?P<nanosecond>\d*))?\s(?P<tz>[\+\-]\d*)')   # noqa
+        self.prog_datetime = re.compile('^(?P<timestamp>\[[^\]]*\])')
+        # The last whole second timestamp that was decoded, most log lines
+        # are in the same second as the line before them
+        self._last_second = None
+        self._last_datetime = None
 
     def _get_log_path(self):
         """Return the current log file location"""
         raise Exception("Log type not defined.")
 
     def _get_all_log_paths(self):
-        """Return all the log paths"""
-        return glob("%s.*-*" % self._get_log_path()) + [self._get_log_path()]
+        """Return all the log paths, the rotated logs first, from the oldest
+        to the most recent, and the current log last
+        """
+        # The rotated logs are suffixed with the time of the rotation, in a
+        # format (YYYYMMDD-HHMMSS) that sorts in chronological order
+        return sorted(glob("%s.*-*" % self._get_log_path())) + [self._get_log_path()]
+
+    def _open_log(self, log):
+        """Open a log file for reading, "zipped" logs are decompressed on the fly"""
+        log = ensure_str(log)
+        if log.endswith('.gz'):
+            return gzip.open(log, 'rt')
+        return open(log, 'r')
+
+    def iter_lines(self, archive=True):
+        """Iterate over the lines of the log, without loading the log in memory
+        @param archive - start with the rotated and "zipped" logs, in
+                         chronological order
+        @return - a generator of the lines of the log
+        """
+        if archive:
+            logs = self._get_all_log_paths()
+        else:
+            self.lpath = self._get_log_path()
+            logs = [self.lpath] if self.lpath is not None else []
+        for log in logs:
+            with self._open_log(log) as lf:
+                for line in lf:
+                    yield line
+
+    def iter_parsed(self, archive=True):
+        """Iterate over the parsed lines of the log
+        @param archive - start with the rotated and "zipped" logs, in
+                         chronological order
+        @return - a generator of the dictionaries of the log parts of each
+                  line, the lines without a timestamp (like the headers of
+                  the logs) are skipped
+        """
+        for line in self.iter_lines(archive):
+            if line.startswith('['):
+                yield self.parse_line(line)
+
+    def _get_line_datetime(self, line, naive=False):
+        """Return the time of a log line
+        @param line - a log line
+        @param naive - drop the time zone of the time
+        @return - a "datetime" object, or None for the lines without a
+                  timestamp
+        """
+        if not line.startswith('['):
+            return None
+        dt = self.parse_timestamp(line[:line.index(']') + 1])
+        if naive:
+            return dt.replace(tzinfo=None)
+        return dt
+
+    def _get_first_datetime(self, log, naive=False):
+        """Return the time of the first line of a log file"""
+        with self._open_log(log) as lf:
+            for line in lf:
+                dt = self._get_line_datetime(line, naive)
+                if dt is not None:
+                    return dt
+        return None
+
+    @staticmethod
+    def _seek_line(lf, offset):
+        """Move to the start of the first line at, or after, an offset"""
+        if offset == 0:
+            lf.seek(0)
+        else:
+            lf.seek(offset - 1)
+            lf.readline()
+
+    def _seek_datetime(self, lf, start, naive=False):
+        """Move to the first line of a log file that is not older than start,
+        by bisection over the offsets of the file
+        @param lf - a log file opened in binary mode
+        @param start - a "datetime" object
+        @param naive - the start time has no time zone
+        """
+        lf.seek(0, 2)
+        low = 0
+        high = lf.tell()
+        while low < high:
+            middle = (low + high) // 2
+            self._seek_line(lf, middle)
+            dt = None
+            for line in iter(lf.readline, b''):
+                dt = self._get_line_datetime(ensure_str(line), naive)
+                if dt is not None:
+                    break
+            if dt is None or dt >= start:
+                high = middle
+            else:
+                low = middle + 1
+        self._seek_line(lf, low)
+
+    def between(self, start, end, archive=True):
+        """Iterate over the lines of the log in a time range.  The logs are
+        written in time order, so the start of the range is found by
+        bisection in each log file and only the range is read ("zipped" logs
+        can not be bisected and are read up to the range).
+        @param start - a "datetime" object, the first time of the range
+        @param end - a "datetime" object, the end of the range (excluded).
+                     Without a time zone, the start and end are compared
+                     with the local times of the log.
+        @param archive - also search the rotated and "zipped" logs
+        @return - a generator of the lines of the log in the range
+        """
+        naive = start.tzinfo is None
+        if archive:
+            logs = self._get_all_log_paths()
+        else:
+            self.lpath = self._get_log_path()
+            logs = [self.lpath] if self.lpath is not None else []
+        firsts = [self._get_first_datetime(log, naive) for log in logs]
+        for idx, log in enumerate(logs):
+            if firsts[idx] is not None and firsts[idx] >= end:
+                break
+            if idx + 1 < len(logs) and firsts[idx + 1] is not None and \
+               firsts[idx + 1] < start:
+                # The whole log is older than the range
+                continue
+            if ensure_str(log).endswith('.gz'):
+                lf = self._open_log(log)
+            else:
+                lf = open(log, 'rb')
+                self._seek_datetime(lf, start, naive)
+            with lf:
+                in_range = False
+                for line in lf:
+                    line = ensure_str(line)
+                    dt = self._get_line_datetime(line, naive)
+                    if dt is None:
+                        # A line continued from the previous timestamp
+                        if in_range:
+                            yield line
+                        continue
+                    if dt >= end:
+                        return
+                    in_range = dt >= start
+                    if in_range:
+                        yield line
 
     def readlines_archive(self):
         """
         Returns an array of all the lines in all logs, included rotated logs
         and compressed logs. (gzip)
-        Will likely be very slow. Try using match instead.
+        Will likely be very slow. Try using iter_lines or match instead.
 
         @return - an array of all the lines in all logs
         """
-        lines = []
-        for log in self._get_all_log_paths():
-            # Open the log
-            if log.endswith(ensure_bytes('.gz')):
-                with gzip.open(log, 'r') as lf:
-                    lines += lf.readlines()
-            else:
-                with open(log, 'r') as lf:
-                    lines += lf.readlines()
-        return lines
+        return list(self.iter_lines(archive=True))
 
     def readlines(self):
         """Returns an array of all the lines in the log.
-        Will likely be very slow. Try using match instead.
+        Will likely be very slow. Try using iter_lines or match instead.
 
         @return - an array of all the lines in the log.
         """
-        lines = []
-        self.lpath = self._get_log_path()
-        if self.lpath is not None:
-            # Open the log
-            with open(self.lpath, 'r') as lf:
-                lines = lf.readlines()
-        return lines
+        return list(self.iter_lines(archive=False))
+
+    def match_many(self, patterns, archive=False):
+        """Search the log for several patterns in a single pass
+        @param patterns - a list of regex patterns
+        @param archive - also search the rotated and "zipped" logs
+        @return - a dictionary of the matching lines of each pattern
+        """
+        matcher = LogMatcher(patterns)
+        results = dict((pattern, []) for pattern in patterns)
+        for line in self.iter_lines(archive):
+            for pattern in matcher.matches(line):
+                results[pattern].append(line)
+        return results
 
     def match_archive(self, pattern):
         """Search all the log files, including "zipped" logs
         @param pattern - a regex pattern
         @return - results of the pattern matching
         """
-        results = []
-        prog = re.compile(pattern)
-        for log in self._get_all_log_paths():
-            if log.endswith(ensure_bytes('.gz')):
-                with gzip.open(log, 'r') as lf:
-                    for line in lf:
-                        mres = prog.match(line)
-                        if mres:
-                            results.append(line)
-            else:
-                with open(log, 'r') as lf:
-                    for line in lf:
-                        mres = prog.match(line)
-                        if mres:
-                            results.append(line)
-        return results
+        return self.match_many([pattern], archive=True)[pattern]
 
     def match(self, pattern):
         """Search the current log file for the pattern
         @param pattern - a regex pattern
         @return - results of the pattern matching
         """
-        results = []
-        prog = re.compile(pattern)
-        self.lpath = self._get_log_path()
-        if self.lpath is not None:
-            with open(self.lpath, 'r') as lf:
-                for line in lf:
-                    mres = prog.match(line)
-                    if mres:
-                        results.append(line)
-        return results
+        return self.match_many([pattern])[pattern]
+
+    def _decode_timestamp(self, ts):
+        """Decode the whole second part of a timestamp
+        @param ts - The timestamp string from a log
+        @return - a "datetime" object
+        """
+        timedata = self.prog_timestamp.match(ts).groupdict()
+        tz = timedata['tz']
+        offset = int(tz[1:3]) * 3600 + int(tz[3:5]) * 60
+        if tz[0] == '-':
+            offset = -offset
+        return datetime(int(timedata['year']),
+                        MONTH_LOOKUP[timedata['month']],
+                        int(timedata['day']),
+                        int(timedata['hour']),
+                        int(timedata['minute']),
+                        int(timedata['second']),
+                        tzinfo=tzoffset(None, offset))
 
     def parse_timestamp(self, ts):
         """Parse a logs timestamps and break it down into its individual parts
         @param ts - The timestamp string from a log
         @return - a "datetime" object
         """
-        timedata = self.prog_timestamp.match(ts).groupdict()
-        # Now, have to convert month to an int.
-        dt_str = '{YEAR}-{MONTH}-{DAY} {HOUR}-{MINUTE}-{SECOND} {TZ}'.format(
-            YEAR=timedata['year'],
-            MONTH=MONTH_LOOKUP[timedata['month']],
-            DAY=timedata['day'],
-            HOUR=timedata['hour'],
-            MINUTE=timedata['minute'],
-            SECOND=timedata['second'],
-            TZ=timedata['tz'],
-            )
-        dt = dt_parse(dt_str)
-        if timedata['nanosecond'] is not '':
-            dt = dt.replace(microsecond=int(int(timedata['nanosecond']) / 1000))
-        return dt
+        # [27/Apr/2016:12:49:49.726093186 +1000]
+        # The timestamp captured by the line regexes can run up to a later ']'
+        # in the message
+        ts = ts[:ts.find(']') + 1]
+        tz_start = ts.rfind(' ')
+        frac_start = ts.find('.', 0, tz_start)
+        if frac_start < 0:
+            second = ts
+            frac = ''
+        else:
+            second = ts[:frac_start] + ts[tz_start:]
+            frac = ts[frac_start + 1:tz_start]
+        if second != self._last_second:
+            self._last_datetime = self._decode_timestamp(ts)
+            self._last_second = second
+        if frac:
+            # Only keep the microseconds of the nanoseconds
+            return self._last_datetime.replace(microsecond=int(frac[:6].ljust(6, '0')))
+        return self._last_datetime
 
     def get_time_in_secs(self, log_line):
         """Take the timestamp (not the date) from a DS log and convert it
@@ -180,9 +762,9 @@ class DirsrvAccessLog(DirsrvLog):
         """
         super(DirsrvAccessLog, self).__init__(dirsrv)
         ## We precompile our regex for parse_line to make it faster.
-        self.prog_m1 = re.compile('^(?P<timestamp>\[.*\])\sconn=(?P<conn>\d*)\sop=(?P<op>\d*)\s(?P<action>\w*)\s(?P<rem>.*)')
-        self.prog_con = re.compile('^(?P<timestamp>\[.*\])\sconn=(?P<conn>\d*)\sfd=(?P<fd>\d*)\sslot=(?P<slot>\d*)\sconnection\sfrom\s(?P<remote>[^\s]*)\sto\s(?P<local>[^\s]*)')
-        self.prog_discon = re.compile('^(?P<timestamp>\[.*\])\sconn=(?P<conn>\d*)\sop=(?P<op>\d*)\sfd=(?P<fd>\d*)\s(?P<action>closed)\s-\s(?P<status>\w*)')
+        self.prog_m1 = re.compile('^(?P<timestamp>\[[^\]]*\])\sconn=(?P<conn>\d*)\sop=(?P<op>\d*)\s(?P<action>\w*)\s(?P<rem>.*)')
+        self.prog_con = re.compile('^(?P<timestamp>\[[^\]]*\])\sconn=(?P<conn>\d*)\sfd=(?P<fd>\d*)\sslot=(?P<slot>\d*)\sconnection\sfrom\s(?P<remote>[^\s]*)\sto\s(?P<local>[^\s]*)')
+        self.prog_discon = re.compile('^(?P<timestamp>\[[^\]]*\])\sconn=(?P<conn>\d*)\sop=(?P<op>\d*)\sfd=(?P<fd>\d*)\s(?P<action>closed)\s-\s(?P<status>\w*)')
         # RESULT regex's (based off action.rem)
         self.prog_notes = re.compile('err=(?P<err>\d*)\stag=(?P<tag>\d*)\snentries=(?P<nentries>\d*)\setime=(?P<etime>[0-9.]*)\snotes=(?P<notes>\w*)')
         self.prog_repl = re.compile('err=(?P<err>\d*)\stag=(?P<tag>\d*)\snentries=(?P<nentries>\d*)\setime=(?P<etime>[0-9.]*)\scsn=(?P<csn>\w*)')
@@ -191,11 +773,97 @@ class DirsrvAccessLog(DirsrvLog):
         self.full_regexs = [self.prog_m1, self.prog_con, self.prog_discon]
         self.result_regexs = [self.prog_notes, self.prog_repl,
                               self.prog_result]
+        # The open indexes of the logs
+        self._indexes = {}
 
     def _get_log_path(self):
         """Return the current log file location"""
         return self.dirsrv.ds_paths.access_log
 
+    def get_index(self, log):
+        """Return the index of an access log file, updated with the lines
+        that were added to the log
+        @param log - an access log file location
+        @return - an AccessLogIndex object
+        """
+        log = ensure_str(log)
+        if log not in self._indexes:
+            self._indexes[log] = AccessLogIndex(log)
+        index = self._indexes[log]
+        index.update()
+        return index
+
+    def build_index(self):
+        """Build, or update, the indexes of all the access logs, and remove
+        the indexes of the logs that were deleted
+        """
+        logs = [ensure_str(log) for log in self._get_all_log_paths()]
+        for log in logs:
+            self.get_index(log)
+        for log in list(self._indexes):
+            if log not in logs:
+                self._indexes.pop(log).db.close()
+        index_paths = set(get_index_path(log) for log in logs)
+        for index_path in glob(get_index_path(logs[-1] + '*')):
+            if index_path not in index_paths:
+                os.remove(index_path)
+
+    def _find(self, method, archive, *args):
+        """Look up the index of each log"""
+        if archive:
+            logs = self._get_all_log_paths()
+        else:
+            logs = [self._get_log_path()]
+        lines = []
+        for log in logs:
+            lines += getattr(self.get_index(log), method)(*args)
+        return lines
+
+    def find_conn(self, conn, archive=True):
+        """Return the lines of a connection, using the log indexes
+        @param conn - a connection number
+        @param archive - also search the rotated and "zipped" logs
+        @return - a list of log lines
+        """
+        return self._find('find_conn', archive, conn)
+
+    def find_op(self, conn, op, archive=True):
+        """Return the lines of an operation, using the log indexes
+        @param conn - a connection number
+        @param op - an operation number
+        @param archive - also search the rotated and "zipped" logs
+        @return - a list of log lines
+        """
+        return self._find('find_op', archive, conn, op)
+
+    def find_csn(self, csn, archive=True):
+        """Return the lines with a CSN, using the log indexes
+        @param csn - a CSN string
+        @param archive - also search the rotated and "zipped" logs
+        @return - a list of log lines
+        """
+        return self._find('find_csn', archive, csn)
+
+    def iter_operations(self, archive=True, maxconns=10000, maxops=100):
+        """Iterate over the operations of the access log, with the request
+        of each operation joined with its result
+        @param archive - start with the rotated and "zipped" logs, in
+                         chronological order
+        @param maxconns - the number of connections to keep track of
+        @param maxops - the number of operations of a connection to keep
+                        track of, while they wait for their result
+        @return - a generator of Operation objects, in the order of their
+                  results.  The operations without a result come last, or
+                  when their connection is closed or released.
+        """
+        tracker = OperationTracker(maxconns, maxops)
+        for line in self.iter_lines(archive):
+            if ' conn=' in line:
+                for operation in tracker.add(line):
+                    yield operation
+        for operation in tracker.flush():
+            yield operation
+
     def parse_line(self, line):
         """
         This knows how to break up an access log line into the specific fields.
@@ -246,7 +914,7 @@ class DirsrvErrorLog(DirsrvLog):
         @param diursrv - A DirSrv object
         """
         super(DirsrvErrorLog, self).__init__(dirsrv)
-        self.prog_m1 = re.compile('^(?P<timestamp>\[.*\])\s(?P<message>.*)')
+        self.prog_m1 = re.compile('^(?P<timestamp>\[[^\]]*\])\s(?P<message>.*)')
 
     def _get_log_path(self):
         """Return the current log file location"""
@@ -41,7 +41,7 @@ def _getCSNTime(inst, csn):
     :returns: The time is seconds that the operation was logged
     """
 
-    op_line = inst.ds_access_log.match('.*csn=%s' % csn)
+    op_line = inst.ds_access_log.find_csn(csn, archive=False)
     if op_line:
         #vals = inst.ds_access_log.parse_line(op_line[0])
         return inst.ds_access_log.get_time_in_secs(op_line[0])
@@ -68,8 +68,8 @@ def _getCSNandTime(inst, line):
         conn = vals['conn']
 
         # Now find the result line and CSN
-        result_line = inst.ds_access_log.match_archive(
-            '.*conn=%s op=%s RESULT.*' % (conn, op))
+        result_line = [result for result in inst.ds_access_log.find_op(conn, op)
+                       if ' RESULT ' in result]
 
         if result_line:
             vals = inst.ds_access_log.parse_line(result_line[0])
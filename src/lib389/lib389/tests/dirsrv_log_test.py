@@ -9,7 +9,9 @@
 from lib389._constants import *
 from lib389.utils import ensure_bytes, ensure_str
 from lib389 import DirSrv, Entry
+from lib389.dirsrv_log import LogMatcher, OperationTracker, get_index_path, get_required_literals
 import pytest
+import re
 import time
 import shutil
 import datetime
@@ -74,7 +76,7 @@ def test_access_log(topology):
         topology.standalone.ds_access_log.parse_line('[27/Apr/2016:12:49:49.726093186 +1000] conn=1 fd=64 slot=64 connection from ::1 to ::1') ==
         {
             'slot': '64', 'remote': '::1', 'action': 'CONNECT', 'timestamp': '[27/Apr/2016:12:49:49.726093186 +1000]', 'fd': '64', 'conn': '1', 'local': '::1',
-            'datetime': datetime.datetime(2016, 4, 27, 12, 0, 0, 726093, tzinfo=tzoffset(None, 36000))
+            'datetime': datetime.datetime(2016, 4, 27, 12, 49, 49, 726093, tzinfo=tzoffset(None, 36000))
         }
     )
     assert(
@@ -82,23 +84,135 @@ def test_access_log(topology):
         {
             'rem': 'base="cn=config" scope=0 filter="(objectClass=*)" attrs="nsslapd-instancedir nsslapd-errorlog nsslapd-accesslog nsslapd-auditlog nsslapd-certdir nsslapd-schemadir nsslapd-bakdir nsslapd-ldifdir"',  # noqa
             'action': 'SRCH', 'timestamp': '[27/Apr/2016:12:49:49.727235997 +1000]', 'conn': '1', 'op': '2',
-            'datetime': datetime.datetime(2016, 4, 27, 12, 0, 0, 727235, tzinfo=tzoffset(None, 36000))
+            'datetime': datetime.datetime(2016, 4, 27, 12, 49, 49, 727235, tzinfo=tzoffset(None, 36000))
         }
     )
     assert(
         topology.standalone.ds_access_log.parse_line('[27/Apr/2016:12:49:49.736297002 +1000] conn=1 op=4 fd=64 closed - U1') ==
         {
             'status': 'U1', 'fd': '64', 'action': 'DISCONNECT', 'timestamp': '[27/Apr/2016:12:49:49.736297002 +1000]', 'conn': '1', 'op': '4',
-            'datetime': datetime.datetime(2016, 4, 27, 12, 0, 0, 736297, tzinfo=tzoffset(None, 36000))
+            'datetime': datetime.datetime(2016, 4, 27, 12, 49, 49, 736297, tzinfo=tzoffset(None, 36000))
         }
     )
     assert(
         topology.standalone.ds_access_log.parse_line('[27/Apr/2016:12:49:49.736297002 -1000] conn=1 op=4 fd=64 closed - U1') ==
         {
             'status': 'U1', 'fd': '64', 'action': 'DISCONNECT', 'timestamp': '[27/Apr/2016:12:49:49.736297002 -1000]', 'conn': '1', 'op': '4',
-            'datetime': datetime.datetime(2016, 4, 27, 12, 0, 0, 736297, tzinfo=tzoffset(None, -36000))
+            'datetime': datetime.datetime(2016, 4, 27, 12, 49, 49, 736297, tzinfo=tzoffset(None, -36000))
         }
     )
+    # Check the months and the timestamps without the nanoseconds
+    assert(
+        topology.standalone.ds_access_log.parse_timestamp('[30/Sep/2016:23:59:59.999999999 +0000]') ==
+        datetime.datetime(2016, 9, 30, 23, 59, 59, 999999, tzinfo=tzoffset(None, 0))
+    )
+    assert(
+        topology.standalone.ds_access_log.parse_timestamp('[01/Oct/2016:00:00:00 -0130]') ==
+        datetime.datetime(2016, 10, 1, 0, 0, 0, tzinfo=tzoffset(None, -5400))
+    )
+
+
+def test_access_log_match_many(topology):
+    """Check that several patterns are matched in one pass"""
+    patterns = ['.*fd=.*', '.*SRCH.*', '.*conn=1 op=.*', '.*no such line.*']
+    results = topology.standalone.ds_access_log.match_many(patterns)
+    for pattern in patterns:
+        assert(results[pattern] == topology.standalone.ds_access_log.match(pattern))
+    assert(len(results['.*fd=.*']) > 0)
+    assert(results['.*no such line.*'] == [])
+
+
+def test_access_log_iter(topology):
+    """Check that the logs can be walked through lazily"""
+    access_log = topology.standalone.ds_access_log
+    assert(list(access_log.iter_lines(archive=False)) == access_log.readlines())
+    assert(list(access_log.iter_lines()) == access_log.readlines_archive())
+    actions = 0
+    for action in access_log.iter_parsed(archive=False):
+        assert('action' in action and 'datetime' in action)
+        actions += 1
+    assert(actions > 0)
+
+
+def test_access_log_between(topology):
+    """Check that a time range of the log is found by bisection"""
+    access_log = topology.standalone.ds_access_log
+    lines = [line for line in access_log.iter_lines(archive=False) if line.startswith('[')]
+    start = access_log._get_line_datetime(lines[len(lines) // 3])
+    end = access_log._get_line_datetime(lines[2 * len(lines) // 3])
+    expected = [line for line in lines if start <= access_log._get_line_datetime(line) < end]
+    assert(list(access_log.between(start, end, archive=False)) == expected)
+    assert(list(access_log.between(end, start, archive=False)) == [])
+
+
+def test_access_log_index(topology):
+    """Check the lookups of the connections and operations in the log index"""
+    access_log = topology.standalone.ds_access_log
+    access_log.build_index()
+    for log in access_log._get_all_log_paths():
+        assert(os.path.exists(get_index_path(log)))
+    action = access_log.parse_line(access_log.match('.*conn=1 op=0 .*')[0])
+    assert(access_log.find_op(action['conn'], action['op']) ==
+           access_log.match_archive('.*conn=%s op=%s .*' % (action['conn'], action['op'])))
+    assert(access_log.find_conn(action['conn']) ==
+           access_log.match_archive('.*conn=%s .*' % action['conn']))
+    assert(access_log.find_csn('ffffffff000000000000') == [])
+
+
+def test_access_log_operations(topology):
+    """Check that the requests are joined with their results"""
+    operations = list(topology.standalone.ds_access_log.iter_operations(archive=False))
+    binds = [operation for operation in operations if operation.action == 'BIND' and operation.complete]
+    assert(len(binds) > 0)
+    assert(binds[0].err == 0 and binds[0].tag == 97 and 'dn' in binds[0].request)
+
+
+def test_operation_tracker():
+    """Check the bounded join of the requests and the results"""
+    tracker = OperationTracker(maxconns=2, maxops=2)
+    assert(tracker.add('[27/Apr/2016:12:49:49.727235997 +1000] conn=1 op=1 SRCH base="cn=config" scope=0 filter="(objectClass=*)" attrs=ALL') == [])  # noqa
+    assert(tracker.add('[27/Apr/2016:12:49:49.727235997 +1000] conn=1 op=1 ENTRY dn="cn=config"') == [])
+    operations = tracker.add('[27/Apr/2016:12:49:49.728000000 +1000] conn=1 op=1 RESULT err=0 tag=101 nentries=1 etime=0.001 notes=U')
+    assert(len(operations) == 1 and operations[0].complete)
+    assert(operations[0].request == {'base': 'cn=config', 'scope': '0', 'filter': '(objectClass=*)', 'attrs': 'ALL'})
+    assert((operations[0].err, operations[0].nentries, operations[0].etime, operations[0].notes) == (0, 1, 0.001, 'U'))
+
+    tracker.add('[27/Apr/2016:12:49:49.729000000 +1000] conn=2 op=0 MOD dn="uid=a,dc=example,dc=com"')
+    operations = tracker.add('[27/Apr/2016:12:49:49.729000000 +1000] conn=2 op=0 RESULT err=0 tag=103 nentries=0 etime=0 csn=5720291d000000010000')  # noqa
+    assert(operations[0].action == 'MOD' and operations[0].csn == '5720291d000000010000')
+
+    # The pending operations are released with their connection
+    tracker.add('[27/Apr/2016:12:49:49.730000000 +1000] conn=2 op=1 DEL dn="uid=a,dc=example,dc=com"')
+    operations = tracker.add('[27/Apr/2016:12:49:49.731000000 +1000] conn=2 op=2 UNBIND')
+    assert([(operation.op, operation.complete) for operation in operations] == [('2', False), ('1', False)])
+    assert('2' not in tracker.conns)
+    tracker.add('[27/Apr/2016:12:49:49.732000000 +1000] conn=1 op=2 SRCH base="" scope=0')
+    operations = tracker.add('[27/Apr/2016:12:49:49.733000000 +1000] conn=1 op=3 fd=64 closed - U1')
+    assert([operation.op for operation in operations] == ['2'])
+
+    # The state is bounded
+    for op in range(5):
+        tracker.add('[27/Apr/2016:12:49:49.734000000 +1000] conn=3 op=%d SRCH base="" scope=0' % op)
+    assert(len(tracker.conns['3']) == 2)
+    assert(len(tracker.flush()) == 2)
+
+
+def test_required_literals():
+    """Check the literals that a line must contain for a regex to match"""
+    assert(get_required_literals('.*csn=5a1b2c3d000000010000') == ['csn=5a1b2c3d000000010000'])
+    assert(get_required_literals(r'.*conn=\d+ op=(\d+) RESULT err=0') == [' RESULT err=0', 'conn=', ' op='])
+    assert(get_required_literals('.*ERR - init_dse_file.*') == ['ERR - init_dse_file'])
+    assert(get_required_literals('ab*c') == ['a', 'c'])
+    assert(get_required_literals('ab+c?') == ['ab'])
+    assert(get_required_literals(r'a\.b[cd]') == ['a.b'])
+    assert(get_required_literals('fd=|closed') == [])
+    assert(get_required_literals('(?i)closed') == [])
+    assert(get_required_literals('closed', re.IGNORECASE) == [])
+
+    matcher = LogMatcher(['.*fd=.*', '.*op=1 .*', '.*csn=.*'])
+    assert(matcher.matches('[27/Apr/2016:12:49:49.726093186 +1000] conn=1 fd=64 slot=64 connection from ::1 to ::1') == ['.*fd=.*'])  # noqa
+    assert(matcher.matches('[27/Apr/2016:12:49:49.736297002 +1000] conn=1 op=1 fd=64 closed - U1') == ['.*fd=.*', '.*op=1 .*'])
+    assert(matcher.matches('[27/Apr/2016:12:49:49.736297002 +1000] conn=1 op=2 UNBIND') == [])
 
 
 def test_error_log(topology):
@@ -113,9 +227,21 @@ def test_error_log(topology):
         topology.standalone.ds_error_log.parse_line('[27/Apr/2016:13:46:35.775670167 +1000] slapd started.  Listening on All Interfaces port 54321 for LDAP requests') ==  # noqa
         {
             'timestamp': '[27/Apr/2016:13:46:35.775670167 +1000]', 'message': 'slapd started.  Listening on All Interfaces port 54321 for LDAP requests',
-            'datetime': datetime.datetime(2016, 4, 27, 13, 0, 0, 775670, tzinfo=tzoffset(None, 36000))
+            'datetime': datetime.datetime(2016, 4, 27, 13, 46, 35, 775670, tzinfo=tzoffset(None, 36000))
         }
     )
+    # The message can have brackets, and dots after a timestamp without nanoseconds
+    assert(
+        topology.standalone.ds_error_log.parse_line('[27/Apr/2016:13:46:35.7756 +1000] - ERR - bind - conn=1 [SIMPLE] failed [x]') ==
+        {
+            'timestamp': '[27/Apr/2016:13:46:35.7756 +1000]', 'message': '- ERR - bind - conn=1 [SIMPLE] failed [x]',
+            'datetime': datetime.datetime(2016, 4, 27, 13, 46, 35, 775600, tzinfo=tzoffset(None, 36000))
+        }
+    )
+    assert(
+        topology.standalone.ds_error_log.parse_timestamp('[27/Apr/2016:13:46:36 +1000] - version 1.4 [plugin]') ==
+        datetime.datetime(2016, 4, 27, 13, 46, 36, tzinfo=tzoffset(None, 36000))
+    )
 
 
 if __name__ == "__main__":